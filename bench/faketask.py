@@ -0,0 +1,348 @@
+#!/usr/bin/env python
+###############################################################################
+# faketask.py - a small stand-in for TaskWarrior used by the benchmarks
+#
+# Understands just enough of TaskWarrior 2.x for twOutline:
+#    <filter> export
+#    <filter> modify wait:<date>|/<from>/<to>/
+#    import <file>
+#    undo
+# The tasks are kept like TaskWarrior keeps them: pending.data and
+# completed.data (one FF4 line per task) and undo.data in the directory
+# given by TASKDATA, so twOutline's outline cache works against it as well.
+# Commands that change the tasks hold an exclusive lock on faketask.lock in
+# that directory (export a shared one), so --jobs can run several at once.
+#
+# A filter is made of uuids, <attribute>:<value>, <attribute>.not:<value>,
+# modified.after:<date>, description~<regex>, +<tag>, -<tag>, 'and', 'or'
+# and parentheses.
+#
+# Usage (set TASK_PROG in twoutline.py to):
+#    python bench/faketask.py
+###############################################################################
+import calendar
+import fcntl
+import json
+import os
+import re
+import sys
+import time
+
+UTC_FORMAT = "%Y%m%dT%H%M%SZ"
+DATE_ATTRIBUTES = [ "due", "end", "entry", "modified", "scheduled", "start", "until", "wait" ]
+UNIT_SECONDS = { "seconds":1, "minutes":60, "hours":3600, "days":86400, "weeks":7*86400 }
+FF4_ATTRIBUTE = re.compile(r'(\w+):"((?:[^"\\]|\\.)*)"')
+LOCK_FILE = "faketask.lock"
+UUID = re.compile(r'^[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}$')
+
+###############################################################################
+# the data files
+
+def encodeFF4(task):
+   """ One line of pending.data/completed.data for task (a dictionary of strings) """
+   attributes = [ ]
+   for name in sorted(task.keys()):
+      value = json.dumps(task[name])[1:-1].replace("[","&open;").replace("]","&close;")
+      attributes.append(name + ':"' + value + '"')
+   return "[" + " ".join(attributes) + "]\n"
+
+def decodeFF4(line):
+   task = { }
+   for name,value in FF4_ATTRIBUTE.findall(line):
+      task[name] = json.loads('"' + value.replace("&open;","[").replace("&close;","]") + '"')
+   return task
+
+def readTasks(dataDir):
+   """ All tasks, pending.data first; the pending ones get their id """
+   tasks = [ ]
+   for name in [ "pending.data", "completed.data" ]:
+      path = os.path.join(dataDir,name)
+      if(os.path.exists(path)==False):
+         continue
+      fin = open(path)
+      for line in fin:
+         if(line.strip()!=""):
+            tasks.append(decodeFF4(line))
+      fin.close()
+   return tasks
+
+def isPendingStatus(status):
+   return status in [ "pending", "waiting", "recurring" ]
+
+def writeTasks(dataDir,tasks):
+   for name,pending in [ ("pending.data",True), ("completed.data",False) ]:
+      path = os.path.join(dataDir,name)
+      fout = open(path + ".tmp","w")
+      for task in tasks:
+         if(isPendingStatus(task.get("status","pending"))==pending):
+            fout.write(encodeFF4(task))
+      fout.close()
+      os.rename(path + ".tmp",path)
+
+def appendUndo(dataDir,changes):
+   """ changes is a list of (old task or None, new task) """
+   fout = open(os.path.join(dataDir,"undo.data"),"a")
+   for old,new in changes:
+      fout.write("time " + str(int(time.time())) + "\n")
+      if(old!=None):
+         fout.write("old " + encodeFF4(old))
+      fout.write("new " + encodeFF4(new))
+      fout.write("---\n")
+   fout.close()
+
+def popUndo(dataDir):
+   """ Removes the last transaction from undo.data and returns (old, new) """
+   path = os.path.join(dataDir,"undo.data")
+   if(os.path.exists(path)==False):
+      return None
+   fin = open(path)
+   blocks = fin.read().split("---\n")
+   fin.close()
+   blocks = [ block for block in blocks if block.strip()!="" ]
+   if(len(blocks)==0):
+      return None
+   old = None
+   new = None
+   for line in blocks[-1].splitlines():
+      if(line.startswith("old ")):
+         old = decodeFF4(line[4:])
+      if(line.startswith("new ")):
+         new = decodeFF4(line[4:])
+   fout = open(path,"w")
+   fout.write("".join([ block + "---\n" for block in blocks[0:-1] ]))
+   fout.close()
+   return (old,new)
+
+def writeDatabase(dataDir,tasks):
+   """ Replaces the data files in dataDir by tasks (exported JSON objects).
+       twOutline's outline cache is removed as well: it relies on undo.data
+       growing with every change and cannot tell that the whole database
+       was swapped.
+   """
+   if(os.path.isdir(dataDir)==False):
+      os.makedirs(dataDir)
+   writeTasks(dataDir,[ fromJSON(task) for task in tasks ])
+   open(os.path.join(dataDir,"undo.data"),"w").close()
+   for name in [ "twoutline.cache", "twoutline.cache.tmp" ]:
+      if(os.path.exists(os.path.join(dataDir,name))):
+         os.remove(os.path.join(dataDir,name))
+
+###############################################################################
+# conversions between the stored strings and the exported JSON
+
+def parseDate(value,now):
+   """ <date> as an epoch string; accepts UTC_FORMAT, epochs and <number><unit> """
+   if(value.isdigit()):
+      return value
+   try:
+      return str(calendar.timegm(time.strptime(value,UTC_FORMAT)))
+   except ValueError:
+      pass
+   match = re.match(r"^([0-9.]+)(seconds|minutes|hours|days|weeks)$",value)
+   if(match==None):
+      raise ValueError("unsupported date '" + value + "'")
+   return str(int(now + float(match.group(1))*UNIT_SECONDS[match.group(2)]))
+
+def toJSON(task,taskID):
+   record = { }
+   for name,value in task.iteritems():
+      if(name in DATE_ATTRIBUTES):
+         value = time.strftime(UTC_FORMAT,time.gmtime(int(value)))
+      if(name=="tags"):
+         value = value.split(",")
+      record[name] = value
+   record["id"] = taskID
+   return record
+
+def fromJSON(record):
+   task = { }
+   for name,value in record.iteritems():
+      if(name in [ "id", "urgency" ]):
+         continue
+      if(name in DATE_ATTRIBUTES):
+         value = parseDate(value,time.time())
+      if(name=="tags"):
+         value = ",".join(value)
+      task[name] = unicode(value)
+   return task
+
+###############################################################################
+# filters
+
+def parseFilter(tokens):
+   """ Returns a function task -> bool; terms are joined by 'and' unless
+       'or' is given, parentheses group
+   """
+   tokens = [ token for token in tokens if token not in [ "", "and" ] ]
+   predicate,pos = parseOr(tokens,0)
+   if(pos!=len(tokens)):
+      raise ValueError("unexpected '" + tokens[pos] + "' in filter")
+   return predicate
+
+def parseOr(tokens,pos):
+   terms = [ ]
+   while True:
+      term,pos = parseAnd(tokens,pos)
+      terms.append(term)
+      if((pos<len(tokens)) and (tokens[pos]=="or")):
+         pos = pos + 1
+         continue
+      return ((lambda task: any([ term(task) for term in terms ])),pos)
+
+def parseAnd(tokens,pos):
+   terms = [ ]
+   uuids = set()
+   while((pos<len(tokens)) and (tokens[pos] not in [ "or", ")" ])):
+      if(tokens[pos]=="("):
+         term,pos = parseOr(tokens,pos+1)
+         if((pos>=len(tokens)) or (tokens[pos]!=")")):
+            raise ValueError("missing ')' in filter")
+         terms.append(term)
+      elif(UUID.match(tokens[pos])!=None):
+         uuids.add(tokens[pos].lower())
+      else:
+         terms.append(parseTerm(tokens[pos]))
+      pos = pos + 1
+   if(len(uuids)>0):
+      # consecutive uuids form a list, like consecutive ids do in TaskWarrior
+      terms.append(lambda task: task.get("uuid") in uuids)
+   return ((lambda task: all([ term(task) for term in terms ])),pos)
+
+def parseTerm(token):
+   if((len(token)>1) and (token[0] in "+-")):
+      tag = token[1:]
+      if(token[0]=="+"):
+         return lambda task: tag in task.get("tags","").split(",")
+      return lambda task: (tag in task.get("tags","").split(",")) == False
+   if(token.startswith("description~")):
+      regex = re.compile(token[len("description~"):].strip("'\""))
+      return lambda task: regex.search(task.get("description","")) != None
+   name,sep,value = token.partition(":")
+   if(sep==""):
+      raise ValueError("unsupported filter term '" + token + "'")
+   if(name=="modified.after"):
+      epoch = int(parseDate(value,time.time()))
+      return lambda task: int(task.get("modified",task.get("entry","0"))) > epoch
+   if(name.endswith(".not")):
+      name = name[0:-len(".not")]
+      return lambda task: task.get(name,"") != value
+   if(value==""):
+      return lambda task: task.get(name,"") == ""
+   # like TaskWarrior, the value only has to match the start
+   return lambda task: task.get(name,"").startswith(value)
+
+def removeOverrides(argv):
+   """ The rc.<name>=<value> arguments are accepted and ignored """
+   return [ arg for arg in argv if ((arg.startswith("rc.") or arg.startswith("rc:")) == False) ]
+
+###############################################################################
+# commands
+
+def main(argv):
+   dataDir = os.environ.get("TASKDATA","")
+   if(dataDir==""):
+      sys.stderr.write("faketask: TASKDATA is not set\n")
+      return 2
+   words = removeOverrides(argv)
+   if(os.path.isdir(dataDir)==False):
+      return runCommand(dataDir,words)
+   # the commands read, change and write back all tasks
+   lock = open(os.path.join(dataDir,LOCK_FILE),"a")
+   try:
+      if("export" in words):
+         fcntl.flock(lock,fcntl.LOCK_SH)
+      else:
+         fcntl.flock(lock,fcntl.LOCK_EX)
+      return runCommand(dataDir,words)
+   finally:
+      lock.close()
+
+def runCommand(dataDir,words):
+   now = time.time()
+   if("export" in words):
+      predicate = parseFilter(words[0:words.index("export")])
+      tasks = readTasks(dataDir)
+      records = [ ]
+      taskID = 0
+      for task in tasks:
+         thisID = 0
+         if(isPendingStatus(task.get("status","pending"))):
+            taskID = taskID + 1
+            thisID = taskID
+         if(predicate(task)):
+            records.append(json.dumps(toJSON(task,thisID)))
+      sys.stdout.write("[\n" + ",\n".join(records) + "\n]\n")
+      return 0
+   if("modify" in words):
+      idx = words.index("modify")
+      predicate = parseFilter(words[0:idx])
+      mods = " ".join(words[idx+1:])
+      tasks = readTasks(dataDir)
+      changes = [ ]
+      for task in tasks:
+         if(predicate(task)==False):
+            continue
+         old = dict(task)
+         if(mods.startswith("wait:")):
+            task["wait"] = parseDate(mods[len("wait:"):],now)
+            task["status"] = "waiting"
+         elif(mods.startswith("/")):
+            pattern,replacement = mods[1:].rstrip("/").split("/",1)
+            task["description"] = re.sub(pattern,replacement,task["description"],1)
+         else:
+            sys.stderr.write("faketask: unsupported modification '" + mods + "'\n")
+            return 2
+         task["modified"] = str(int(now))
+         changes.append((old,task))
+      if(len(changes)==0):
+         sys.stderr.write("faketask: no matching tasks\n")
+         return 1
+      writeTasks(dataDir,tasks)
+      appendUndo(dataDir,changes)
+      return 0
+   if((len(words)==2) and (words[0]=="import")):
+      tasks = readTasks(dataDir)
+      byUUID = dict([ (task["uuid"],ii) for ii,task in enumerate(tasks) ])
+      changes = [ ]
+      fin = open(words[1])
+      for line in fin:
+         if(line.strip()==""):
+            continue
+         task = fromJSON(json.loads(line))
+         task["modified"] = str(int(now))
+         if(task["uuid"] in byUUID):
+            changes.append((tasks[byUUID[task["uuid"]]],task))
+            tasks[byUUID[task["uuid"]]] = task
+         else:
+            changes.append((None,task))
+            byUUID[task["uuid"]] = len(tasks)
+            tasks.append(task)
+      fin.close()
+      writeTasks(dataDir,tasks)
+      appendUndo(dataDir,changes)
+      return 0
+   if(words==[ "undo" ]):
+      change = popUndo(dataDir)
+      if(change==None):
+         sys.stderr.write("faketask: no transactions to undo\n")
+         return 1
+      old,new = change
+      tasks = readTasks(dataDir)
+      for ii,task in enumerate(tasks):
+         if(task["uuid"]==new["uuid"]):
+            if(old!=None):
+               tasks[ii] = old
+            else:
+               del tasks[ii]
+            break
+      writeTasks(dataDir,tasks)
+      return 0
+   sys.stderr.write("faketask: unsupported command '" + " ".join(words) + "'\n")
+   return 2
+
+if __name__ == "__main__":
+   try:
+      sys.exit(main(sys.argv[1:]))
+   except ValueError as e:
+      sys.stderr.write("faketask: " + str(e) + "\n")
+      sys.exit(2)
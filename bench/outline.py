@@ -0,0 +1,269 @@
+#!/usr/bin/env python
+###############################################################################
+# outline.py - benchmarks of twOutline's hot paths
+#
+# Generates synthetic outlines, serves them to twOutline through
+# bench/faketask.py and times the outline operations at every size. Each run
+# is appended to a history file and compared with the previous run of the
+# same benchmark, so that regressions show up.
+#
+# Usage:
+#    python bench/outline.py [options]     (--help lists them)
+###############################################################################
+import copy
+import json
+import optparse
+import os
+import pipes
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0,os.path.join(BENCH_DIR,".."))
+import twoutline
+import faketask
+
+TASK_FILTER = "project:bench"
+CLI_MODIFY_TASKS = 20 # tasks modified by the 'cli modify wait' benchmark
+WAIT_DATES  = [ "2030%02d%02dT%02d0000Z" % (1+ii%12,1+ii%28,ii%24) for ii in range(50) ]
+
+###############################################################################
+# synthetic outlines
+
+def generateLabels(size,breadth,depth,gaps,rng):
+   """ size structured labels (as tuples) filling a tree level by level;
+       each section has up to breadth subsections and the numbering of
+       siblings skips a number with probability gaps
+   """
+   labels = [ ]
+   parents = [ () ]
+   while((len(labels)<size) and (len(parents)>0)):
+      children = [ ]
+      for parent in parents:
+         number = 0
+         for ii in range(breadth):
+            if(len(labels)>=size):
+               break
+            number = number + 1
+            if(rng.random()<gaps):
+               number = number + 1
+            label = parent + (number,)
+            labels.append(label)
+            if(len(label)<depth):
+               children.append(label)
+      parents = children
+   return sorted(labels)
+
+def generateTasks(labels,waiting,rng):
+   tasks = [ ]
+   for ii,label in enumerate(labels):
+      task = { "uuid":str(uuid.UUID(int=rng.getrandbits(128),version=4)),
+               "description":twoutline.OUTLINE_SEP.join([ str(key) for key in label ]) + " task " + str(ii),
+               "entry":"20130101T000000Z",
+               "project":"bench",
+               "status":"pending" }
+      if(rng.random()<waiting):
+         task["status"] = "waiting"
+         task["wait"]   = rng.choice(WAIT_DATES)
+      tasks.append(task)
+   return tasks
+
+###############################################################################
+# timing
+
+def bestTime(fcn,prepare,repeat):
+   """ Smallest wall time of fcn(prepare()) over repeat runs; prepare is not timed """
+   best = None
+   for ii in range(repeat):
+      arg = prepare()
+      start = time.time()
+      fcn(arg)
+      elapsed = time.time() - start
+      if((best==None) or (elapsed<best)):
+         best = elapsed
+   return best
+
+class QuietStdout(object):
+   """ Sends what twOutline prints to /dev/null while a benchmark runs """
+   def __enter__(self):
+      self.saved = sys.stdout
+      sys.stdout = open(os.devnull,"w")
+   def __exit__(self,excType,excValue,traceback):
+      sys.stdout.close()
+      sys.stdout = self.saved
+
+def importOutline(useCache,readDataFiles=False,scope=()):
+   twoutline.OUTLINE_CACHE = useCache
+   twoutline.TASKWARRIOR_DATA_READER = readDataFiles
+   ol = twoutline.createOutline()
+   ol.importFromTaskWarrior(TASK_FILTER,scope)
+   return ol
+
+def resetLocalTimeStrings():
+   # a fresh process starts with an empty cache
+   twoutline.theLocalTimeStrings = twoutline.LRUCache(twoutline.LOCAL_TIME_CACHE_ENTRIES)
+
+def moveSection(ol,aa,bb,locationCmd):
+   A = ol.removeOutlineForStructuredLabel(aa)
+   if(locationCmd=="before"):
+      ol.insertOutlineBeforeStructuredLabel(A,bb)
+   if(locationCmd=="after"):
+      ol.insertOutlineAfterStructuredLabel(A,bb)
+   if(locationCmd=="under"):
+      ol.insertOutlineUnderStructuredLabel(A,bb)
+
+def noVisit(taskUUID, taskID, taskDesc, taskStatus, userData):
+   return
+
+def runBenchmarks(size,options,dataDir):
+   """ Returns { benchmark name: seconds } """
+   rng = random.Random(options.seed)
+   labels = generateLabels(size,options.breadth,options.depth,options.gaps,rng)
+   tasks  = generateTasks(labels,options.waiting,rng)
+   faketask.writeDatabase(dataDir,tasks)
+   topLabels = [ label for label in labels if len(label)==1 ]
+   first  = twoutline.OUTLINE_SEP.join([ str(key) for key in labels[0] ])
+   last   = twoutline.OUTLINE_SEP.join([ str(key) for key in labels[-1] ])
+   # every task is one TaskWarrior 'modify', so only time a few of them
+   lastModified = twoutline.OUTLINE_SEP.join([ str(key) for key in labels[min(len(labels),CLI_MODIFY_TASKS)-1] ])
+   moved  = str(topLabels[len(topLabels)//2][0]) # moves 1/breadth of the outline
+   target = str(topLabels[0][0])
+   repeat = options.repeat
+   ol = importOutline(False)
+   def freshCopy():
+      return copy.deepcopy(ol)
+   def same():
+      return ol
+   results = { }
+   results["import"] = bestTime(lambda x: importOutline(False),lambda: None,repeat)
+   importOutline(True) # fill the cache
+   results["import (cached)"] = bestTime(lambda x: importOutline(True),lambda: None,repeat)
+   results["import (data files)"] = bestTime(lambda x: importOutline(False,True),lambda: None,repeat)
+   twoutline.TASKWARRIOR_DATA_READER = False
+   # a section holding 1/breadth of the outline
+   scope = twoutline.SectionLabel(topLabels[len(topLabels)//2])
+   results["import (scope)"] = bestTime(lambda x: importOutline(False,False,scope),lambda: None,repeat)
+   results["collectOutlinePaths"] = bestTime(lambda x: x.collectOutlinePaths(),same,repeat)
+   results["compressOutline"] = bestTime(lambda x: x.compressOutline(),freshCopy,repeat)
+   for locationCmd in [ "before", "after", "under" ]:
+      results["move " + locationCmd] = bestTime(lambda x: moveSection(x,moved,target,locationCmd),freshCopy,repeat)
+   results["visitFromSectionToSection"] = bestTime(
+      lambda x: x.visitFromSectionToSection(first,last,noVisit,None),same,repeat)
+   sink = open(os.devnull,"w")
+   def renderPreparation():
+      resetLocalTimeStrings()
+      return ol
+   results["printOutlineAsText"]  = bestTime(lambda x: x.printOutlineAsText(sink),renderPreparation,repeat)
+   results["printOutlineAsLatex"] = bestTime(lambda x: x.printOutlineAsLatex(sink),renderPreparation,repeat)
+   sink.close()
+   if(size<=options.cliMax):
+      # complete commands, TaskWarrior (the stand-in) included
+      def freshDatabase():
+         faketask.writeDatabase(dataDir,tasks)
+         resetLocalTimeStrings()
+      twoutline.OUTLINE_CACHE = False
+      with QuietStdout():
+         results["cli compress"] = bestTime(
+            lambda x: twoutline.main([ TASK_FILTER, "compress" ]),freshDatabase,repeat)
+         results["cli modify wait"] = bestTime(
+            lambda x: twoutline.main([ TASK_FILTER, "modify", first, "to", lastModified, "wait", "all", WAIT_DATES[0] ]),
+            freshDatabase,repeat)
+   return results
+
+###############################################################################
+# history
+
+def getCommit():
+   try:
+      return subprocess.Popen([ "git", "rev-parse", "--short", "HEAD" ],cwd=BENCH_DIR,
+                              stdout=subprocess.PIPE,stderr=open(os.devnull,"w")).communicate()[0].strip()
+   except OSError:
+      return ""
+
+def loadHistory(path):
+   history = [ ]
+   if(os.path.exists(path)):
+      for line in open(path):
+         if(line.strip()!=""):
+            history.append(json.loads(line))
+   return history
+
+def findPreviousRun(history,run):
+   for previous in reversed(history):
+      if((previous["engine"]==run["engine"]) and (previous["params"]==run["params"]) and
+         (previous["size"]==run["size"])):
+         return previous
+   return None
+
+def writeReport(run,previous,threshold):
+   """ Returns the number of benchmarks slower than the previous run by more than threshold """
+   numRegressions = 0
+   sys.stdout.write("\n%d tasks, %s engine\n" % (run["size"],run["engine"]))
+   sys.stdout.write("%-28s %10s %10s %8s\n" % ("benchmark","ms","previous","change"))
+   for name in sorted(run["results"].keys()):
+      seconds = run["results"][name]
+      line = "%-28s %10.2f" % (name,seconds*1000.0)
+      if((previous!=None) and (name in previous["results"]) and (previous["results"][name]>0.0)):
+         change = seconds/previous["results"][name] - 1.0
+         line = line + " %10.2f %+7.0f%%" % (previous["results"][name]*1000.0,change*100.0)
+         if(change>threshold):
+            line = line + "  SLOWER"
+            numRegressions = numRegressions + 1
+      sys.stdout.write(line + "\n")
+   return numRegressions
+
+def main(argv):
+   parser = optparse.OptionParser(usage="python bench/outline.py [options]")
+   parser.add_option("--sizes",default="1000,10000,100000",help="comma separated numbers of tasks [%default]")
+   parser.add_option("--breadth",type="int",default=10,help="max subsections per section [%default]")
+   parser.add_option("--depth",type="int",default=5,help="max depth of the outline [%default]")
+   parser.add_option("--gaps",type="float",default=0.2,help="probability of a gap in the numbering [%default]")
+   parser.add_option("--waiting",type="float",default=0.3,help="fraction of waiting tasks [%default]")
+   parser.add_option("--seed",type="int",default=1,help="seed of the generated outlines [%default]")
+   parser.add_option("--engine",default=twoutline.OUTLINE_ENGINE,help="OUTLINE_ENGINE to use [%default]")
+   parser.add_option("--repeat",type="int",default=3,help="runs per benchmark, the best one counts [%default]")
+   parser.add_option("--cli-max",dest="cliMax",type="int",default=1000,
+                     help="largest size for the complete command benchmarks [%default]")
+   parser.add_option("--history",default=os.path.join(BENCH_DIR,"history.jsonl"),
+                     help="file the results are appended to [%default]")
+   parser.add_option("--threshold",type="float",default=0.25,
+                     help="slowdown reported as a regression [%default]")
+   parser.add_option("--check",action="store_true",default=False,
+                     help="exit with status 1 if there is a regression")
+   options,args = parser.parse_args(argv)
+   twoutline.OUTLINE_ENGINE = options.engine
+   dataDir = tempfile.mkdtemp(prefix="twoutline-bench")
+   savedTaskData = os.environ.get("TASKDATA")
+   os.environ["TASKDATA"] = dataDir
+   twoutline.TASK_PROG = pipes.quote(sys.executable) + " " + pipes.quote(os.path.join(BENCH_DIR,"faketask.py"))
+   params = { "breadth":options.breadth, "depth":options.depth, "gaps":options.gaps,
+              "waiting":options.waiting, "seed":options.seed, "repeat":options.repeat }
+   history = loadHistory(options.history)
+   numRegressions = 0
+   try:
+      for size in [ int(size) for size in options.sizes.split(",") ]:
+         run = { "date":time.strftime("%Y-%m-%d %H:%M:%S"), "commit":getCommit(),
+                 "engine":options.engine, "params":params, "size":size,
+                 "results":runBenchmarks(size,options,dataDir) }
+         numRegressions = numRegressions + writeReport(run,findPreviousRun(history,run),options.threshold)
+         fout = open(options.history,"a")
+         fout.write(json.dumps(run,sort_keys=True) + "\n")
+         fout.close()
+         history.append(run)
+   finally:
+      shutil.rmtree(dataDir)
+      if(savedTaskData==None):
+         del os.environ["TASKDATA"]
+      else:
+         os.environ["TASKDATA"] = savedTaskData
+   if((options.check==True) and (numRegressions>0)):
+      return 1
+   return 0
+
+if __name__ == "__main__":
+   sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+###############################################################################
+# startup.py - wall time of short twOutline commands
+#
+# Runs 'twOutline undo 1' and 'twOutline --help' a number of times and prints
+# the minimum and median wall time of each, next to the time Python needs to
+# start at all. A small table of contents is timed as well, made by
+# twOutline itself and by 'twOutline serve' through --server and twclient.py
+# ('undo' always runs in the client, so it cannot show the server's latency).
+# TaskWarrior is replaced by bench/faketask.py on a database of TOC_TASKS
+# tasks, so mostly twOutline's own startup is measured.
+#
+# Usage:
+#    python bench/startup.py [<numberOfRuns>]
+###############################################################################
+import os
+import py_compile
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+TWOUTLINE = os.path.join(os.path.dirname(os.path.abspath(__file__)),"..","twoutline.py")
+TWCLIENT  = os.path.join(os.path.dirname(os.path.abspath(__file__)),"..","twclient.py")
+FAKETASK  = os.path.join(os.path.dirname(os.path.abspath(__file__)),"faketask.py")
+TOC_TASKS = 20
+TOC_ARGS  = [ "project:bench", "tableofcontents", "all", "text" ]
+
+def timeCommand(cmd,env,numRuns):
+   """ Returns the sorted wall times of numRuns runs of cmd """
+   times = [ ]
+   devnull = open(os.devnull,"w")
+   for ii in range(numRuns):
+      start = time.time()
+      subprocess.call(cmd,env=env,stdout=devnull,stderr=devnull)
+      times.append(time.time() - start)
+   devnull.close()
+   return sorted(times)
+
+def writeTocDatabase(dataDir):
+   sys.path.insert(0,os.path.dirname(FAKETASK))
+   import faketask
+   tasks = [ ]
+   for ii in range(TOC_TASKS):
+      tasks.append({ "uuid":"00000000-0000-4000-8000-%012d" % ii, "description":"%d.%d task" % (1+ii//5,1+ii%5),
+                     "entry":"20130101T000000Z", "project":"bench", "status":"pending" })
+   faketask.writeDatabase(dataDir,tasks)
+
+def main(argv):
+   numRuns = 20
+   if(len(argv)>0):
+      numRuns = int(argv[0])
+   # a 'task' running bench/faketask.py, found first in the PATH
+   stubDir = tempfile.mkdtemp(prefix="twoutline-bench")
+   try:
+      stub = os.path.join(stubDir,"task")
+      fout = open(stub,"w")
+      fout.write("#!/bin/sh\nexec \"" + sys.executable + "\" \"" + FAKETASK + "\" \"$@\"\n")
+      fout.close()
+      os.chmod(stub,0755)
+      env = dict(os.environ)
+      env["PATH"] = stubDir + os.pathsep + env.get("PATH","")
+      env["TASKDATA"] = stubDir # the server's socket goes there
+      writeTocDatabase(stubDir)
+      py_compile.compile(TWOUTLINE) # what twclient.py loads, even with PYTHONDONTWRITEBYTECODE
+      devnull = open(os.devnull,"w")
+      server = subprocess.Popen([ sys.executable, TWOUTLINE, "serve" ],env=env,stdout=devnull,stderr=devnull)
+      socketPath = os.path.join(stubDir,"twoutline.sock")
+      while((os.path.exists(socketPath)==False) and (server.poll()==None)):
+         time.sleep(0.01)
+      commands = [ ("python",           [ sys.executable, "-c", "pass" ]),
+                   ("twOutline undo 1", [ sys.executable, TWOUTLINE, "undo", "1" ]),
+                   ("twOutline --help", [ sys.executable, TWOUTLINE, "--help" ]),
+                   ("twOutline toc",    [ sys.executable, TWOUTLINE ] + TOC_ARGS),
+                   ("--server toc",     [ sys.executable, TWOUTLINE, "--server" ] + TOC_ARGS),
+                   ("twclient toc",     [ sys.executable, TWCLIENT ] + TOC_ARGS) ]
+      sys.stdout.write("%-18s %10s %10s\n" % ("command","min ms","median ms"))
+      try:
+         for name,cmd in commands:
+            times = timeCommand(cmd,env,numRuns)
+            sys.stdout.write("%-18s %10.1f %10.1f\n" % (name,times[0]*1000.0,times[len(times)//2]*1000.0))
+      finally:
+         server.terminate()
+         server.wait()
+         devnull.close()
+   finally:
+      shutil.rmtree(stubDir)
+
+if __name__ == "__main__":
+   main(sys.argv[1:])
@@ -0,0 +1,17 @@
+#!/usr/bin/env python
+###############################################################################
+# twclient - thin client of 'twoutline.py serve'
+#
+# Same as 'twoutline.py --server <arguments>', only faster to start: a
+# script is compiled on every run, while the imported twoutline module is
+# loaded from its compiled twoutline.pyc. Keep this file next to
+# twoutline.py.
+#
+# Usage:
+#    twclient.py <arguments of twoutline.py>
+###############################################################################
+import sys
+import twoutline
+
+if __name__ == "__main__":
+   twoutline.main([ "--server" ] + sys.argv[1:])
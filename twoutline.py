@@ -43,65 +43,950 @@ PRINT_DATE_TIME_FORMAT = "%Y/%m/%d %H:%M"
 #
 # Do not change the following unless you are sure you know what to do
 UTC_FORMAT = "%Y%m%dT%H%M%SZ"  # Zulu time zone used by TaskWarrior
+USE_TASKWARRIOR_IMPORT = True  # apply description changes in bulk with 'task import'
+                               # set to False for TaskWarrior before 2.4.0, where
+                               # 'import' cannot modify already existing tasks
+BATCH_CHUNK_SIZE = 500         # max number of tasks per bulk export/import
+EXPORT_FIELDS = ["uuid","id","description","status","wait"] # task fields kept by the outline
+EXPORT_READ_SIZE = 65536       # bytes read at a time from 'task export'
+EXPORT_LABEL_FILTER = True     # have 'task export' skip the tasks whose description does
+                               # not start with a digit
+OUTLINE_CACHE      = True      # keep imported outlines on disk between runs
+OUTLINE_CACHE_FILE = ""        # "" means twoutline.cache in TaskWarrior's data.location
+                               # set OUTLINE_CACHE to False if you use 'task sync'
+                               # (synchronized changes keep their old modification time;
+                               # compress and moves re-import whenever the data files
+                               # changed, so only listings can miss them)
+OUTLINE_CACHE_ENTRIES = 8      # number of filters kept in the cache
+OUTLINE_SCOPE = True           # import only the section an operation works in (with
+                               # its subsections and the sections containing it)
+                               # for 'tableofcontents from', 'modify' and moves
+OUTLINE_JOURNAL      = True    # record the changes of every operation for 'undo-last'
+                               # (needs USE_TASKWARRIOR_IMPORT)
+OUTLINE_JOURNAL_FILE = ""      # "" means twoutline.journal in TaskWarrior's data.location
+OUTLINE_JOURNAL_ENTRIES = 20   # number of operations kept in the journal
+TASKWARRIOR_DATA_READER = False # read pending.data and completed.data directly instead
+                               # of running 'task export' when the filter only has
+                               # project:, status(.not):, +tag and -tag terms (read only;
+                               # TaskWarrior 2.x data files)
+OUTLINE_ENGINE = "tree"        # "tree", "compact" (flat arrays; faster to walk huge
+                               # outlines and smaller to keep, e.g. by 'serve', but
+                               # imported through a tree so the peak memory is the
+                               # same) or
+                               # "matrix" (NumPy arrays; fastest compress, paths and
+                               # printing of huge outlines but slow moves; "tree"
+                               # is used without NumPy)
+TASKWARRIOR_SESSION = False    # run queued 'modify' commands through one long lived
+                               # shell instead of starting a new shell for each
+                               # (needs a POSIX sh; saves a few milliseconds per
+                               # command, little next to starting TaskWarrior)
+TASKWARRIOR_JOBS = 1           # number of queued 'modify' commands run at the same
+                               # time (see --jobs); values above 1 use a thread pool
+TASKWARRIOR_LOCK_RETRIES = 5   # times a command is retried when TaskWarrior could
+                               # not lock its data files
+TASKWARRIOR_LOCK_WAIT = 0.2    # seconds before the first retry (grows with each retry)
+OUTPUT_CHUNK_LINES = 4096      # lines of a table of contents joined per write
+PROFILE_TOP_FUNCTIONS = 30     # functions listed by --profile -
+LOCAL_TIME_CACHE_ENTRIES = 4096 # converted wait dates remembered (many tasks share them)
+SERVE_SOCKET = ""              # Unix socket of 'serve' and --server; "" means
+                               # twoutline.sock in TaskWarrior's data.location
 ### 
 
+# Only the modules needed by every command are imported here; the others
+# (pytz, tempfile, threading, codecs, mmap, re, socket, numpy) are imported by the code using them
+# so that e.g. 'undo' starts quickly
+import array
+import bisect
+import cPickle
 import json  # See http://json.org/
 import os
-import platform
 import string
+import subprocess
 import sys
 import time
 import datetime
-import pytz      # See http://pytz.sourceforge.net/
-                 # Tested with: pytz-2012c-py2.7.egg
+import itertools
 
-if(LOCAL_TIMEZONE not in pytz.all_timezones):
-   raise RuntimeError("Did NOT find timezone '" + LOCAL_TIMEZONE + "'")
-theLocalTimeZone = pytz.timezone(LOCAL_TIMEZONE) 
+theTimeZones = None # (utc, local) once getUTCandLocalTimeZones() was called
+
+def getUTCandLocalTimeZones():
+   """ Imports pytz and looks up LOCAL_TIMEZONE the first time a date
+       is converted
+   """
+   global theTimeZones
+   if(theTimeZones==None):
+      import pytz      # See http://pytz.sourceforge.net/
+                       # Tested with: pytz-2012c-py2.7.egg
+      if(LOCAL_TIMEZONE not in pytz.all_timezones_set):
+         raise RuntimeError("Did NOT find timezone '" + LOCAL_TIMEZONE + "'")
+      theTimeZones = (pytz.utc, pytz.timezone(LOCAL_TIMEZONE))
+   return theTimeZones
 
 def getNowInUTCandLocalTime():
+   utcTimeZone,localTimeZone = getUTCandLocalTimeZones()
    nowInUTC = datetime.datetime.utcnow()
    # make the naive datetime into a UTC aware datetime
-   nowInUTC = pytz.utc.localize(nowInUTC)
+   nowInUTC = utcTimeZone.localize(nowInUTC)
    # convert to local time zone
-   nowInLocalTimeZone = nowInUTC.astimezone(theLocalTimeZone)
+   nowInLocalTimeZone = nowInUTC.astimezone(localTimeZone)
    return (nowInUTC, nowInLocalTimeZone) 
 
+class LRUCache(object):
+   """ A dictionary holding at most maxEntries entries. Once it is full the
+       least recently used half of the entries is dropped in one go, so a
+       hit only costs a dictionary lookup.
+   """
+   def __init__(self,maxEntries):
+      self.maxEntries = maxEntries
+      self.entries = { } # key:[value, time of last use]
+      self.clock = 0
+   def get(self,key):
+      """ Returns None if key is not in the cache """
+      entry = self.entries.get(key)
+      if(entry==None):
+         return None
+      self.clock = self.clock + 1
+      entry[1] = self.clock
+      return entry[0]
+   def put(self,key,value):
+      if((len(self.entries)>=self.maxEntries) and ((key in self.entries) == False)):
+         byLastUse = sorted(self.entries.iterkeys(),key=lambda k: self.entries[k][1])
+         for oldKey in byLastUse[0:len(byLastUse)-self.maxEntries//2]:
+            del self.entries[oldKey]
+      self.clock = self.clock + 1
+      self.entries[key] = [value,self.clock]
+
+theLocalTimeStrings = LRUCache(LOCAL_TIME_CACHE_ENTRIES) # utc string:local string
+
+def parseUTCTimeString(utcTimeAsString):
+   """ Same as datetime.strptime(utcTimeAsString, UTC_FORMAT) but slicing
+       the fixed width fields of TaskWarrior's format e.g. 20120530T143000Z
+   """
+   if((UTC_FORMAT=="%Y%m%dT%H%M%SZ") and (len(utcTimeAsString)==16) and
+      (utcTimeAsString[8]=="T") and (utcTimeAsString[15]=="Z") and
+      utcTimeAsString[0:8].isdigit() and utcTimeAsString[9:15].isdigit()):
+      try:
+         return datetime.datetime(int(utcTimeAsString[0:4]), int(utcTimeAsString[4:6]),
+                                  int(utcTimeAsString[6:8]), int(utcTimeAsString[9:11]),
+                                  int(utcTimeAsString[11:13]), int(utcTimeAsString[13:15]))
+      except ValueError:
+         pass # let strptime() report the problem
+   return datetime.datetime.strptime(utcTimeAsString, UTC_FORMAT)
+
 def convertUTCTimeStringToLocalTimeString(utcTimeAsString):
+   localTimeAsString = theLocalTimeStrings.get(utcTimeAsString)
+   if(localTimeAsString!=None):
+      return localTimeAsString
+   utcTimeZone,localTimeZone = getUTCandLocalTimeZones()
    # create naive datetime from string
-   parsedUTC = datetime.datetime.strptime(utcTimeAsString, UTC_FORMAT)
+   parsedUTC = parseUTCTimeString(utcTimeAsString)
    # make the naive datetime into a UTC aware datetime
-   parsedUTC = pytz.utc.localize(parsedUTC)
+   parsedUTC = utcTimeZone.localize(parsedUTC)
    # convert UTC time into local time zone
-   parsedUTC = parsedUTC.astimezone(theLocalTimeZone)
+   parsedUTC = parsedUTC.astimezone(localTimeZone)
    # convert to string format
    localTimeAsString = parsedUTC.strftime(PRINT_DATE_TIME_FORMAT)
+   theLocalTimeStrings.put(utcTimeAsString,localTimeAsString)
    return localTimeAsString 
 
+class TimingSpan(object):
+   """ Adds the time spent inside a 'with' block to a span of RunStatistics """
+   def __init__(self,stats,name):
+      self.stats = stats
+      self.name  = name
+   def __enter__(self):
+      self.start = time.time()
+   def __exit__(self,excType,excValue,traceback):
+      self.stats.addTime(self.name,time.time()-self.start)
+
+class NoTimingSpan(object):
+   def __enter__(self):
+      pass
+   def __exit__(self,excType,excValue,traceback):
+      pass
+
+class RunStatistics(object):
+   """ Named timing spans and counters of one run (see --stats and
+       --profile). Spans may contain other spans, so their times do not
+       add up. Nothing is measured unless enabled is True.
+   """
+   def __init__(self):
+      self.enabled  = False
+      self.spans    = { } # name:[calls, seconds]
+      self.counters = { } # name:value
+      self.noSpan   = NoTimingSpan()
+   def span(self,name):
+      """ with theStatistics.span("name"): ... """
+      if(self.enabled==False):
+         return self.noSpan
+      return TimingSpan(self,name)
+   def addTime(self,name,seconds):
+      if(self.enabled==False):
+         return
+      if((name in self.spans) == False):
+         self.spans[name] = [ 0, 0.0 ]
+      self.spans[name][0] += 1
+      self.spans[name][1] += seconds
+   def count(self,name,amount=1):
+      if(self.enabled==False):
+         return
+      self.counters[name] = self.counters.get(name,0) + amount
+   def writeAsText(self,fout):
+      fout.write("twOutline statistics\n")
+      fout.write("   %-36s %8s %10s\n" % ("span","calls","seconds"))
+      for name in sorted(self.spans.keys()):
+         calls,seconds = self.spans[name]
+         fout.write("   %-36s %8d %10.4f\n" % (name,calls,seconds))
+      fout.write("   %-36s %8s\n" % ("counter","value"))
+      for name in sorted(self.counters.keys()):
+         fout.write("   %-36s %8d\n" % (name,self.counters[name]))
+   def writeAsJSON(self,fout):
+      spans = dict([ (name,{ "calls":calls, "seconds":seconds }) for name,(calls,seconds) in self.spans.iteritems() ])
+      fout.write(json.dumps({ "spans":spans, "counters":self.counters },sort_keys=True) + "\n")
+
+theStatistics = RunStatistics()
+
+def getTaskWarriorCommandName(cmd):
+   """ e.g. 'taskwarrior modify' for the spans of the dispatched commands """
+   for word in cmd.split():
+      if(word in [ "export", "import", "modify", "undo" ]):
+         return "taskwarrior " + word
+   return "taskwarrior command"
+
+class TaskWarriorExecutor(object):
+   """ Runs TaskWarrior commands, each one in its own shell. Commands
+       given to submit() may be delayed until flush(); run() and
+       collectJSON() run right away (after the submitted commands).
+       Use setTaskWarriorExecutor() to plug in another backend, e.g. a
+       fake TaskWarrior that records the commands.
+   """
+   def __init__(self):
+      self.failures = [ ] # (cmd, exit status) of failed submitted commands
+   def run(self,cmd):
+      cmd = TASK_PROG + " rc.verbose=nothing " + cmd
+      # Debugging
+      # sys.stdout.write("running: '" + cmd + "'\n")
+      ###
+      sys.stdout.flush()
+      theStatistics.count("taskwarrior commands")
+      with theStatistics.span(getTaskWarriorCommandName(cmd)):
+         if(theOutlineMemory==None):
+            return subprocess.call(cmd,shell=True)
+         # a 'serve' request: the output goes to the client, which cannot
+         # answer a prompt
+         status,output,errors = runCommandWithoutTerminal(cmd)
+         sys.stdout.write(output)
+         sys.stderr.write(errors)
+         return status
+   def submit(self,cmd):
+      status = self.run(cmd)
+      if(status!=0):
+         self.failures.append((cmd,status))
+   def flush(self):
+      """ Waits for all submitted commands and returns the (cmd, exit status)
+          of those that failed since the last flush
+      """
+      failures = self.failures
+      self.failures = [ ]
+      return failures
+   def collectJSON(self,cmd,fields=None,required=True):
+      """ Generator yielding the tasks printed by TaskWarrior as they are
+          read from the pipe. If fields is given, only those fields of each
+          task are kept. If required is True, printing no task is an error.
+      """
+      cmd = TASK_PROG + " rc.verbose=nothing rc.json.array=yes " + cmd
+      # Debugging
+      # sys.stdout.write("running: '" + cmd + "'\n")
+      ###
+      theStatistics.count("taskwarrior commands")
+      # only the time spent running TaskWarrior and parsing its output
+      # counts, not the time the caller spends with each task
+      elapsed = 0.0
+      start = time.time()
+      numTasks = 0
+      stdin  = None
+      stderr = None
+      if(theOutlineMemory!=None):
+         # a 'serve' request: keep the server's terminal out of it and
+         # pass the errors on to the client
+         import tempfile
+         stdin  = open(os.devnull,"r")
+         stderr = tempfile.TemporaryFile()
+      proc = subprocess.Popen(cmd,shell=True,stdin=stdin,stdout=subprocess.PIPE,stderr=stderr)
+      try:
+         for task in iterateJSONObjects(proc.stdout):
+            numTasks = numTasks + 1
+            if(fields!=None):
+               task = dict([ (field,task[field]) for field in fields if field in task ])
+            elapsed = elapsed + (time.time() - start)
+            start = None
+            yield task
+            start = time.time()
+         if((numTasks==0) and (required==True)):
+            raise RuntimeError("No matching tasks for: " + cmd)
+      finally:
+         if(start==None):
+            start = time.time()
+         proc.stdout.close()
+         proc.wait()
+         if(stderr!=None):
+            stdin.close()
+            stderr.seek(0)
+            sys.stderr.write(stderr.read())
+            stderr.close()
+         theStatistics.addTime(getTaskWarriorCommandName(cmd),elapsed + (time.time() - start))
+         theStatistics.count("tasks exported",numTasks)
+   def close(self):
+      self.flush()
+
+class TaskWarriorSessionExecutor(TaskWarriorExecutor):
+   """ Queues the submitted commands and feeds them, one after the other,
+       to a single long lived shell so that the shell is started once
+       instead of once per command. The shell reports the exit status of
+       each command on its standard output after a marker. The commands
+       read their standard input from /dev/null since the shell's
+       standard input carries the commands that follow.
+   """
+   STATUS_MARKER = "twoutline-status:"
+   def __init__(self):
+      TaskWarriorExecutor.__init__(self)
+      self.queue = [ ]
+      self.shell = None
+   def run(self,cmd):
+      self.__sendQueuedCommands()
+      return TaskWarriorExecutor.run(self,cmd)
+   def submit(self,cmd):
+      self.queue.append(cmd)
+      if(len(self.queue)>=BATCH_CHUNK_SIZE):
+         self.__sendQueuedCommands()
+   def flush(self):
+      self.__sendQueuedCommands()
+      return TaskWarriorExecutor.flush(self)
+   def collectJSON(self,cmd,fields=None,required=True):
+      self.__sendQueuedCommands()
+      return TaskWarriorExecutor.collectJSON(self,cmd,fields,required)
+   def close(self):
+      TaskWarriorExecutor.close(self)
+      if(self.shell!=None):
+         self.shell.stdin.close()
+         self.shell.wait()
+         self.shell = None
+   def __sendQueuedCommands(self):
+      """ Internal utility function; not meant to be invoked """
+      queue = self.queue
+      self.queue = [ ]
+      if(len(queue)==0):
+         return
+      if(self.shell==None):
+         sys.stdout.flush()
+         self.shell = subprocess.Popen(["sh"],stdin=subprocess.PIPE,stdout=subprocess.PIPE)
+      for cmd in queue:
+         theStatistics.count("taskwarrior commands")
+         start = time.time()
+         redirection = " </dev/null"
+         if(theOutlineMemory!=None):
+            redirection = redirection + " 2>&1" # a 'serve' request: the client gets the errors
+         self.shell.stdin.write(TASK_PROG + " rc.verbose=nothing " + cmd + redirection + "\n" +
+                                "echo \"" + self.STATUS_MARKER + "$?\"\n")
+         self.shell.stdin.flush()
+         # pass the output of the command through until its status shows up
+         while True:
+            line = self.shell.stdout.readline()
+            if(line==""):
+               raise RuntimeError("TaskWarrior session ended while running: " + cmd)
+            idx = line.find(self.STATUS_MARKER)
+            if(idx<0):
+               sys.stdout.write(line)
+               continue
+            sys.stdout.write(line[0:idx])
+            status = int(line[idx+len(self.STATUS_MARKER):])
+            if(status!=0):
+               self.failures.append((cmd,status))
+            break
+         theStatistics.addTime(getTaskWarriorCommandName(cmd),time.time()-start)
+
+class TaskWarriorParallelExecutor(TaskWarriorExecutor):
+   """ Queues the submitted commands and runs them with up to 'jobs'
+       TaskWarrior processes at the same time. Only commands that do not
+       depend on each other (e.g. one 'modify' per task) may be submitted.
+       TaskWarrior itself serializes the writes with a lock on its data
+       files; a command that could not get the lock is retried up to
+       TASKWARRIOR_LOCK_RETRIES times. The output and the failures of the
+       commands are reported in the order they were submitted.
+   """
+   def __init__(self,jobs):
+      TaskWarriorExecutor.__init__(self)
+      self.jobs  = jobs
+      self.queue = [ ]
+   def run(self,cmd):
+      self.__runQueuedCommands()
+      return TaskWarriorExecutor.run(self,cmd)
+   def submit(self,cmd):
+      self.queue.append(cmd)
+   def flush(self):
+      self.__runQueuedCommands()
+      return TaskWarriorExecutor.flush(self)
+   def collectJSON(self,cmd,fields=None,required=True):
+      self.__runQueuedCommands()
+      return TaskWarriorExecutor.collectJSON(self,cmd,fields,required)
+   def __runQueuedCommands(self):
+      """ Internal utility function; not meant to be invoked """
+      queue = self.queue
+      self.queue = [ ]
+      if(len(queue)==0):
+         return
+      import Queue
+      import threading
+      sys.stdout.flush()
+      pending = Queue.Queue()
+      for ii,cmd in enumerate(queue):
+         pending.put((ii,cmd))
+      results = [ None ] * len(queue)
+      workers = [ ]
+      for ii in range(min(self.jobs,len(queue))):
+         worker = threading.Thread(target=self.__runCommandsFromQueue,args=(pending,results))
+         worker.start()
+         workers.append(worker)
+      for worker in workers:
+         worker.join()
+      for ii,cmd in enumerate(queue):
+         status,output,errors,seconds = results[ii]
+         # the commands ran side by side, so their times add up to more
+         # than the time spent here
+         theStatistics.count("taskwarrior commands")
+         theStatistics.addTime(getTaskWarriorCommandName(cmd),seconds)
+         sys.stdout.write(output)
+         sys.stderr.write(errors)
+         if(status!=0):
+            self.failures.append((cmd,status))
+   def __runCommandsFromQueue(self,pending,results):
+      """ Internal utility function; not meant to be invoked """
+      import Queue
+      while True:
+         try:
+            ii,cmd = pending.get_nowait()
+         except Queue.Empty:
+            return
+         try:
+            results[ii] = self.__runCommandWithRetries(cmd)
+         except OSError as e:
+            results[ii] = (-1,"",str(e) + "\n",0.0)
+   def __runCommandWithRetries(self,cmd):
+      """ Internal utility function; not meant to be invoked """
+      wait = TASKWARRIOR_LOCK_WAIT
+      start = time.time()
+      for attempt in range(TASKWARRIOR_LOCK_RETRIES+1):
+         status,output,errors = runCommandWithoutTerminal(TASK_PROG + " rc.verbose=nothing " + cmd)
+         if((status==0) or ("lock" not in errors.lower())):
+            break
+         time.sleep(wait)
+         wait = wait * 2
+      return (status,output,errors,time.time()-start)
+
+def runCommandWithoutTerminal(cmd):
+   """ Runs the shell command with its standard input from /dev/null and
+       returns (exit status, output, errors)
+   """
+   devnull = open(os.devnull,"r")
+   try:
+      proc = subprocess.Popen(cmd,shell=True,stdin=devnull,stdout=subprocess.PIPE,stderr=subprocess.PIPE)
+      output,errors = proc.communicate()
+   finally:
+      devnull.close()
+   return (proc.returncode,output,errors)
+
+def createTaskWarriorExecutor(jobs=None):
+   if(jobs==None):
+      jobs = TASKWARRIOR_JOBS
+   if(jobs>1):
+      return TaskWarriorParallelExecutor(jobs)
+   if(TASKWARRIOR_SESSION==True):
+      return TaskWarriorSessionExecutor()
+   return TaskWarriorExecutor()
+
+theTaskWarriorExecutor = None
+
+def setTaskWarriorExecutor(executor):
+   """ Installs the executor used by all the functions below and returns
+       the previous one (None if none was used yet)
+   """
+   global theTaskWarriorExecutor
+   previous = theTaskWarriorExecutor
+   theTaskWarriorExecutor = executor
+   return previous
+
+def getTaskWarriorExecutor():
+   if(theTaskWarriorExecutor==None):
+      setTaskWarriorExecutor(createTaskWarriorExecutor())
+   return theTaskWarriorExecutor
+
 def runTaskWarriorCommand(cmd):
-   cmd = TASK_PROG + " rc.verbose=nothing " + cmd
-   # Debugging
-   # sys.stdout.write("running: '" + cmd + "'\n")
-   ###
-   os.system(cmd)
+   return getTaskWarriorExecutor().run(cmd)
 
-def runTaskWarriorCommandAndCollectJSON(cmd):
-   cmd = TASK_PROG + " rc.verbose=nothing rc.json.array=yes " + cmd
-   # Debugging
-   # sys.stdout.write("running: '" + cmd + "'\n")
-   ###
-   fin,fout = os.popen4(cmd)
-   result   = fout.read()
-   if( (result==None) or (result=="") ):
-      raise RuntimeError("No matching tasks for: " + cmd)
-   jsonObj  = json.loads(result)
-   return jsonObj
-
-def findFirstKeyForValueInDictionary(val, dic):
-   for k,v in dic.iteritems():
-      if v==val:
-         return k;
-   return None
+def submitTaskWarriorCommand(cmd):
+   """ Like runTaskWarriorCommand() but the command may run later; the
+       failures are reported by flushTaskWarriorCommands()
+   """
+   getTaskWarriorExecutor().submit(cmd)
+
+def flushTaskWarriorCommands():
+   return getTaskWarriorExecutor().flush()
+
+def runTaskWarriorCommandAndCollectJSON(cmd,fields=None,required=True):
+   return getTaskWarriorExecutor().collectJSON(cmd,fields,required)
+
+def extractLongOptions(argv,names):
+   """ Removes the options in names (e.g. "--jobs") from argv. names maps
+       each option to True if it is followed by a value. Returns the values
+       of the given options (True for options without value) and the
+       remaining arguments.
+   """
+   options = { }
+   remaining = [ ]
+   ii = 0
+   while(ii<len(argv)):
+      arg = argv[ii]
+      if((arg in names) == False):
+         remaining.append(arg)
+      elif(names[arg]==False):
+         options[arg] = True
+      elif(ii+1<len(argv)):
+         ii = ii + 1
+         options[arg] = argv[ii]
+      else:
+         raise RuntimeError("Option " + arg + " needs a value")
+      ii = ii + 1
+   return (options,remaining)
+
+def writeFailedCommands(failures):
+   for cmd,status in failures:
+      sys.stdout.write("TaskWarrior failed (exit status " + str(status) + "): " + cmd + "\n")
+
+def iterateJSONObjects(fin):
+   """ Parses a stream holding either a JSON array of objects or one
+       object per line and yields the objects one at a time. Only the
+       object being parsed is buffered, so memory stays bounded no
+       matter how big the stream is.
+   """
+   decoder = json.JSONDecoder()
+   buf = ""
+   pos = 0
+   eof = False
+   while True:
+      # skip the array brackets and the separators between objects
+      while((pos<len(buf)) and (buf[pos] in "[],\r\n\t ")):
+         pos = pos + 1
+      if(pos<len(buf)):
+         try:
+            obj,pos = decoder.raw_decode(buf,pos)
+            yield obj
+            continue
+         except ValueError:
+            # an incomplete object, unless there is nothing more to read
+            if(eof==True):
+               raise RuntimeError("Could not parse JSON: " + buf[pos:pos+80])
+      elif(eof==True):
+         return
+      chunk = fin.read(EXPORT_READ_SIZE)
+      theStatistics.count("bytes read",len(chunk))
+      eof   = (chunk=="")
+      buf   = buf[pos:] + chunk
+      pos   = 0
+
+def quoteFilterArgument(argument):
+   """ Double quotes keep ^ [ ] ~ $ ( ) literal both in a POSIX shell and in
+       cmd.exe (which leaves their removal to the program)
+   """
+   return '"' + argument + '"'
+
+def combineTaskWarriorFilters(taskfilter,extraFilter):
+   """ The user filter may contain 'or' so keep it in parentheses """
+   if(taskfilter.strip()==""):
+      return extraFilter
+   if(len(set(taskfilter.split()) & set(["or","xor"]))==0):
+      return taskfilter + " " + extraFilter
+   return quoteFilterArgument("(") + " " + taskfilter + " " + quoteFilterArgument(")") + " " + extraFilter
+
+def combineWithLabelFilter(taskfilter,scope=()):
+   """ Lets TaskWarrior leave out the tasks that cannot have a structured
+       label (see EXPORT_LABEL_FILTER) or, for a scoped import, the tasks
+       outside scope (see getScopeFilter()). Its command line parser splits
+       arguments at parentheses, so only the first digit is checked and
+       SectionLabel.parseDescription() still checks the whole label.
+   """
+   if(len(scope)>0):
+      return combineTaskWarriorFilters(taskfilter,"rc.regex=on " + getScopeFilter(scope))
+   if(EXPORT_LABEL_FILTER==False):
+      return taskfilter
+   return combineTaskWarriorFilters(taskfilter,"rc.regex=on " + quoteFilterArgument("description~^[0-9]"))
+
+SCOPE_FILTER_DEPTH = 8 # deeper scopes are exported as their whole top level section
+
+def getScopeFilter(scope):
+   """ TaskWarrior filter for the tasks of section scope, its subsections
+       and the sections containing it. It lets a few more through (e.g.
+       7.20 for 7.2), which SectionLabel.isInScope() leaves out.
+   """
+   if(len(scope)>SCOPE_FILTER_DEPTH):
+      # the filter grows with the square of the depth
+      return quoteFilterArgument("description~^" + str(scope[0]))
+   sep   = "[" + OUTLINE_SEP + "]"
+   terms = [ quoteFilterArgument("description~^" + string.join([ str(key) for key in scope ],sep)) ]
+   for depth in range(1,len(scope)):
+      ancestor = string.join([ str(key) for key in scope[0:depth] ],sep)
+      terms.append(quoteFilterArgument("description~^" + ancestor + "[^0-9" + OUTLINE_SEP + "]"))
+      terms.append(quoteFilterArgument("description~^" + ancestor + "$"))
+   if(len(terms)==1):
+      return terms[0]
+   return quoteFilterArgument("(") + " " + string.join(terms," or ") + " " + quoteFilterArgument(")")
+
+PENDING_FILTER = "status.not:completed status.not:deleted" # added by --pending
+
+def getTaskWarriorDataLocation():
+   """ data.location as given by TASKDATA or the taskrc file """
+   if(os.environ.get("TASKDATA","")!=""):
+      return os.path.expanduser(os.environ["TASKDATA"])
+   location = "~/.task"
+   try:
+      fin = open(os.path.expanduser(os.environ.get("TASKRC","~/.taskrc")))
+      for line in fin:
+         key,sep,val = line.partition("=")
+         if((sep=="=") and (key.strip()=="data.location")):
+            location = val.split("#")[0].strip()
+      fin.close()
+   except IOError:
+      pass # TaskWarrior falls back to its default as well
+   return os.path.expanduser(location)
+
+def getTaskWarriorDataFileStamps():
+   """ (mtime, size) of each TaskWarrior data file, None if missing """
+   stamps = { }
+   dataLocation = getTaskWarriorDataLocation()
+   for name in ["pending.data","completed.data","undo.data"]:
+      try:
+         st = os.stat(os.path.join(dataLocation,name))
+         stamps[name] = (st.st_mtime,st.st_size)
+      except OSError:
+         stamps[name] = None
+   return stamps
+
+DATA_FILE_DATE_FIELDS = ["due","end","entry","modified","scheduled","start","until","wait"]
+
+def compileDataFileFilter(taskfilter):
+   """ Returns a function task -> bool for the filters understood by
+       readTaskWarriorDataFiles(): project:, status:, status.not:, +tag
+       and -tag terms joined by 'and', with the meaning 'task export'
+       gives them (a value matches the start of the attribute). Returns
+       None for any other filter, which has to be left to TaskWarrior.
+   """
+   terms = [ ]
+   for word in taskfilter.split():
+      if(word=="and"):
+         continue
+      if(("\"" in word) or ("'" in word) or ("\\" in word)):
+         return None
+      name,sep,value = word.partition(":")
+      if((sep==":") and (name in ["project","status"])):
+         if(value==""):
+            terms.append(lambda task,name=name: task.get(name,"")=="")
+         else:
+            terms.append(lambda task,name=name,value=value: task.get(name,"").startswith(value))
+      elif((sep==":") and (name=="status.not")):
+         terms.append(lambda task,value=value: task.get("status","")!=value)
+      elif((len(word)>1) and (word[0] in "+-") and (word[1:].isupper()==False) and (word.find(":")<0)):
+         # upper case tags are TaskWarrior's virtual tags
+         if(word[0]=="+"):
+            terms.append(lambda task,tag=word[1:]: tag in task.get("tags","").split(","))
+         else:
+            terms.append(lambda task,tag=word[1:]: (tag in task.get("tags","").split(","))==False)
+      else:
+         return None
+   return lambda task: all([ term(task) for term in terms ])
+
+def decodeDataFileValue(value):
+   """ An attribute value of a data file line as a unicode string """
+   if("&" in value):
+      value = value.replace("&open;","[").replace("&close;","]").replace("&dquot;","\"")
+   if("\\" in value):
+      return json.loads('"' + value + '"') # TaskWarrior 2.4 escapes like JSON
+   return unicode(value,"utf-8")
+
+def readTaskWarriorDataFiles(taskfilter,fields):
+   """ The tasks 'task <taskfilter> export' would print, read straight
+       from pending.data and completed.data, with only the given fields
+       and without the tasks that cannot have a structured label.
+       Returns None if the filter is not understood or if TaskWarrior
+       would change the tasks when it loads them (garbage collection,
+       expired wait dates, recurrence), so the caller has to fall back
+       to 'export'.
+   """
+   predicate = compileDataFileFilter(taskfilter)
+   if(predicate==None):
+      return None
+   import mmap
+   import re
+   attribute = re.compile(r'(\w+):"([^"\\]*(?:\\.[^"\\]*)*)"') # name:"value"
+   wanted = set(fields) | set(["status","project","tags"])
+   nowAsEpoch = time.time()
+   tasks = [ ]
+   with theStatistics.span("read data files"):
+      for name in ["pending.data","completed.data"]:
+         try:
+            fin = open(os.path.join(getTaskWarriorDataLocation(),name),"rb")
+         except IOError:
+            continue # like TaskWarrior, a missing file has no tasks
+         try:
+            if(os.fstat(fin.fileno()).st_size==0):
+               continue
+            data = mmap.mmap(fin.fileno(),0,access=mmap.ACCESS_READ)
+            try:
+               taskID = 0
+               line = data.readline()
+               while(line!=""):
+                  task = { }
+                  for key,value in attribute.findall(line):
+                     if(key in wanted):
+                        task[key] = decodeDataFileValue(value)
+                  line = data.readline()
+                  if(("uuid" in task) == False):
+                     continue
+                  status = task.get("status","pending")
+                  if(name=="pending.data"):
+                     if(status in ["completed","deleted","recurring"]):
+                        return None
+                     if((status=="waiting") and (float(task.get("wait","0"))<=nowAsEpoch)):
+                        return None
+                     taskID = taskID + 1
+                  if(predicate(task)==False):
+                     continue
+                  if(task.get("description","")[0:1].isdigit()==False):
+                     continue # cannot have a structured label
+                  task["id"] = taskID
+                  for field in DATA_FILE_DATE_FIELDS:
+                     if(field in task):
+                        task[field] = time.strftime(UTC_FORMAT,time.gmtime(int(task[field])))
+                  tasks.append(dict([ (field,task[field]) for field in fields if field in task ]))
+            finally:
+               data.close()
+         finally:
+            fin.close()
+   theStatistics.count("tasks read from data files",len(tasks))
+   if(len(tasks)==0):
+      return None # let 'export' report that no task matches
+   return tasks
+
+def getOutlineCacheFile():
+   if(OUTLINE_CACHE_FILE!=""):
+      return os.path.expanduser(OUTLINE_CACHE_FILE)
+   return os.path.join(getTaskWarriorDataLocation(),"twoutline.cache")
+
+def loadOutlineCache():
+   """ Returns the key:entry dictionary of the cache file (empty if the
+       file is missing, unreadable or was written by another version)
+   """
+   try:
+      fin = open(getOutlineCacheFile(),"rb")
+      try:
+         cache = cPickle.load(fin)
+      finally:
+         fin.close()
+      if(cache.get("version")==6):
+         return cache["entries"]
+   except Exception:
+      pass # a broken cache is just rebuilt
+   return { }
+
+def saveOutlineCacheEntry(key,entry):
+   entries = loadOutlineCache()
+   entries[key] = entry
+   # forget the filters that were refreshed the longest time ago
+   while(len(entries)>OUTLINE_CACHE_ENTRIES):
+      oldestKey = min(entries.keys(),key=lambda k: entries[k]["stamp"])
+      del entries[oldestKey]
+   path = getOutlineCacheFile()
+   try:
+      # write to a temporary file first so readers never see half a cache
+      fout = open(path + ".tmp","wb")
+      cPickle.dump({ "version":6, "entries":entries },fout,cPickle.HIGHEST_PROTOCOL)
+      fout.close()
+      os.rename(path + ".tmp",path)
+   except (IOError,OSError) as e:
+      sys.stderr.write("twOutline could not write cache '" + path + "': " + str(e) + "\n")
+
+def hasExpiredWaitDate(tasks):
+   """ True if a task of the uuid:task dictionary waits until a date that
+       has passed: TaskWarrior unwaits it without modifying it, so no data
+       file stamp or modification time tells
+   """
+   nowInUTC = time.strftime(UTC_FORMAT,time.gmtime())
+   for task in tasks.itervalues():
+      if((task["status"]=="waiting") and (task.get("wait","")<=nowInUTC)):
+         return True
+   return False
+
+def exportTasksByUUID(uuids):
+   """ uuid:task dictionary of the complete records of the given tasks,
+       exported BATCH_CHUNK_SIZE tasks at a time; tasks that do not
+       exist are missing
+   """
+   recordsByUUID = { }
+   for start in range(0,len(uuids),BATCH_CHUNK_SIZE):
+      chunk = uuids[start:start+BATCH_CHUNK_SIZE]
+      for record in runTaskWarriorCommandAndCollectJSON(string.join(chunk) + " export",None,False):
+         recordsByUUID[record["uuid"]] = record
+   return recordsByUUID
+
+def getOutlineJournalFile():
+   if(OUTLINE_JOURNAL_FILE!=""):
+      return os.path.expanduser(OUTLINE_JOURNAL_FILE)
+   return os.path.join(getTaskWarriorDataLocation(),"twoutline.journal")
+
+def loadOutlineJournal():
+   """ The journaled operations, oldest first, each one a dictionary
+       with the command and its changes:
+          {"uuid": ..., "description": [old, new]}
+          {"uuid": ..., "wait": [old, new], "status": [old, new]}
+       (a missing wait is null)
+   """
+   try:
+      fin = open(getOutlineJournalFile())
+   except IOError:
+      return [ ]
+   try:
+      return [ json.loads(line) for line in fin if line.strip()!="" ]
+   finally:
+      fin.close()
+
+def saveOutlineJournal(operations):
+   path = getOutlineJournalFile()
+   try:
+      # write to a temporary file first so that a crash keeps the old journal
+      fout = open(path + ".tmp","w")
+      for operation in operations[-OUTLINE_JOURNAL_ENTRIES:]:
+         fout.write(json.dumps(operation,sort_keys=True) + "\n")
+      fout.close()
+      os.rename(path + ".tmp",path)
+   except (IOError,OSError) as e:
+      sys.stderr.write("twOutline could not write journal '" + path + "': " + str(e) + "\n")
+
+def journalOperation(command,taskfilter,changes):
+   with theStatistics.span("write journal"):
+      operations = loadOutlineJournal()
+      operations.append({ "command":command, "filter":taskfilter, "time":time.strftime(UTC_FORMAT,time.gmtime()), "changes":changes })
+      saveOutlineJournal(operations)
+   theStatistics.count("journaled changes",len(changes))
+
+def undoLastOperation():
+   """ Restores the descriptions and wait dates changed by the last
+       journaled operation with one import per BATCH_CHUNK_SIZE tasks.
+       Tasks whose description or wait date changed since, or whose old
+       section is used by another task now, are left alone and reported.
+   """
+   if(USE_TASKWARRIOR_IMPORT==False):
+      raise RuntimeError("undo-last needs 'task import' (see USE_TASKWARRIOR_IMPORT)")
+   operations = loadOutlineJournal()
+   if(len(operations)==0):
+      raise RuntimeError("The twOutline journal is empty, nothing to undo")
+   operation = operations[-1]
+   current = exportTasksByUUID([ change["uuid"] for change in operation["changes"] ])
+   records = { } # uuid:restored record
+   conflicts = [ ]
+   for change in operation["changes"]:
+      uuid = change["uuid"]
+      record = records.get(uuid,current.get(uuid))
+      if(record==None):
+         conflicts.append((uuid,"no longer in TaskWarrior"))
+         continue
+      if("description" in change):
+         if(record["description"]!=change["description"][1]):
+            conflicts.append((uuid,record["description"]))
+            continue
+         record["description"] = change["description"][0]
+      if("wait" in change):
+         if((record.get("wait")!=change["wait"][1]) or (record.get("status")!=change["status"][1])):
+            conflicts.append((uuid,record["description"]))
+            continue
+         if(change["wait"][0]==None):
+            record.pop("wait",None)
+         else:
+            record["wait"] = change["wait"][0]
+         record["status"] = change["status"][0]
+      # drop the columns TaskWarrior computes on its own
+      for column in ["id","urgency"]:
+         if(column in record):
+            del record[column]
+      records[uuid] = record
+   conflicts.extend(removeTakenSections(records,operation.get("filter")))
+   restored = records.values()
+   failures = [ ]
+   for start in range(0,len(restored),BATCH_CHUNK_SIZE):
+      chunk = restored[start:start+BATCH_CHUNK_SIZE]
+      status = runTaskWarriorImport(chunk)
+      if(status!=0):
+         failures.append(("import of " + str(len(chunk)) + " task(s)",status))
+   if(len(failures)>0):
+      # keep the journal entry so that undo-last can be run again; the
+      # tasks restored already are left alone as changed since
+      writeFailedCommands(failures)
+      raise RuntimeError("undo-last could not restore all tasks changed by '" + operation["command"] + "'")
+   saveOutlineJournal(operations[0:-1])
+   sys.stdout.write("twOutline restored " + str(len(restored)) + " task(s) changed by '" + operation["command"] + "'\n")
+   if(len(conflicts)>0):
+      sys.stdout.write("   " + str(len(conflicts)) + " task(s) changed since or whose section is taken were left alone:\n")
+      for uuid,desc in conflicts:
+         sys.stdout.write("      " + uuid + " " + desc + "\n")
+   if(len(restored)>0):
+      sys.stdout.write("   To undo the restore run the following:\n")
+      sys.stdout.write("      twOutline undo " + str(len(restored)) + "\n")
+
+def removeTakenSections(records,taskfilter):
+   """ Removes from the uuid:restored record dictionary the records whose
+       section would be used by another task of the outline of taskfilter
+       (all tasks for the journal entries written before the filter was
+       recorded) and returns them as (uuid, description) conflicts
+   """
+   if(len(records)==0):
+      return [ ]
+   if(taskfilter==None):
+      taskfilter = ""
+   labelIndex = importOutline(taskfilter,SectionLabel(()),True).getSectionLabelIndex()
+   currentLabels = dict(itertools.izip(labelIndex.uuids,labelIndex.labels))
+   conflicts = [ ]
+   while True:
+      # the sections after the restore; a task left alone keeps its own
+      owners = { } # label:uuids
+      for uuid,label in currentLabels.iteritems():
+         if((uuid in records) == False):
+            owners.setdefault(label,[ ]).append(uuid)
+      for uuid,record in records.iteritems():
+         label = SectionLabel.parseDescription(record["description"])
+         if(label!=None):
+            owners.setdefault(label,[ ]).append(uuid)
+      taken = [ ]
+      for label,uuids in owners.iteritems():
+         if(len(uuids)>1):
+            taken.extend([ uuid for uuid in uuids if uuid in records ])
+      if(len(taken)==0):
+         return conflicts
+      for uuid in taken:
+         conflicts.append((uuid,records.pop(uuid)["description"] + " (section taken)"))
+
+def runTaskWarriorImport(records):
+   """ Imports the records (a list of task dictionaries, one JSON object
+       per line) with a single invocation of TaskWarrior. Records whose
+       uuid already exists replace the existing task. Returns the exit
+       status of TaskWarrior.
+   """
+   import tempfile
+   fd,path = tempfile.mkstemp(prefix="twoutline",suffix=".json")
+   try:
+      fout = os.fdopen(fd,"w")
+      for record in records:
+         fout.write(json.dumps(record) + "\n")
+      fout.close()
+      return runTaskWarriorCommand("import " + path)
+   finally:
+      os.remove(path)
 
 def extractStringBeforeFirstSpace(stringToExtractFrom):
    elementIdx = stringToExtractFrom.find(" ")
@@ -110,27 +995,357 @@ def extractStringBeforeFirstSpace(stringToExtractFrom):
       return stringToExtractFrom
    return stringToExtractFrom[0:elementIdx]
 
+class SectionLabel(tuple):
+   """ A structured label such as 1.2.3 parsed into the tuple (1,2,3).
+       Tuples compare in outline order. Labels are interned, so every
+       distinct string is split and converted to integers only once.
+   """
+   __slots__ = ()
+   __interned = { } # string:SectionLabel
+   @staticmethod
+   def clearInterned():
+      """ Forgets the interned labels; serve calls it before every request
+          so the labels of renumbered tasks do not pile up
+      """
+      SectionLabel.__interned.clear()
+   @staticmethod
+   def parse(sl):
+      """ Input is a string like "1.2.3.4" (or an already parsed label) """
+      if(isinstance(sl,SectionLabel)):
+         return sl
+      label = SectionLabel.__interned.get(sl)
+      if(label==None):
+         numbers = [ ]
+         for ll in sl.split(OUTLINE_SEP):
+            if(ll.isdigit()==False):
+               sys.stdout.write("<section> = " + sl + "\n")
+               raise RuntimeError("<section> should be composed of digits")
+            if(int(ll)<1):
+               sys.stdout.write("<section> = " + sl + "\n")
+               raise RuntimeError("<section> should be composed of digits that are >= 1")
+            numbers.append(int(ll))
+         label = SectionLabel(numbers)
+         SectionLabel.__interned[sl] = label
+      return label
+   @staticmethod
+   def parseDescription(desc):
+      """ Returns the label a task description starts with, None if the
+          description does not start with digits separated by OUTLINE_SEP
+      """
+      sl = extractStringBeforeFirstSpace(desc)
+      if((sl in SectionLabel.__interned) == False):
+         for ll in sl.split(OUTLINE_SEP):
+            if(ll.isdigit()==False):
+               return None
+      return SectionLabel.parse(sl)
+   def depth(self):
+      return len(self)
+   def isPrefixOf(self,other):
+      """ True for the label itself and all of its subsections """
+      return ((len(self)<=len(other)) and (other[0:len(self)]==self))
+   def isInScope(self,scope):
+      """ True for scope, its subsections and the sections containing it """
+      return (scope.isPrefixOf(self) or self.isPrefixOf(scope))
+   def child(self,key):
+      return SectionLabel(self + (key,))
+   def children(self,keys):
+      return [ SectionLabel(self + (key,)) for key in keys ]
+   def nextSibling(self):
+      return SectionLabel(self[0:-1] + (self[-1]+1,))
+   def __str__(self):
+      return string.join([ str(number) for number in self ],OUTLINE_SEP)
+
+def extendPaths(path,keys):
+   """ The paths of the subsections keys of the section at path ("" for
+       the top level)
+   """
+   if(path==""):
+      return [ str(key) for key in keys ]
+   prefix = path + OUTLINE_SEP
+   return [ prefix + str(key) for key in keys ]
+
+def replaceStructuredLabelInDescription(desc,oldPath,newPath):
+   """ Same as the TaskWarrior substitution /^oldPath /newPath / """
+   if(extractStringBeforeFirstSpace(desc)!=oldPath):
+      raise RuntimeError("Description '" + desc + "' does not start with '" + oldPath + "' anymore")
+   return newPath + desc[len(oldPath):]
+
+def getStatusColumnForTask(task):
+   status = task["status"]
+   if(status=="completed"):
+      status = status + "\t" # add an extra tab so things line up
+   if(status=="pending"):
+      status = "\t\t"        # add an extra tab so things line up
+   if(status=="waiting"):
+      status = convertUTCTimeStringToLocalTimeString(task["wait"])
+   return status
+
+def formatTaskAsText(task):
+   return str(task["id"]) + "\t" + getStatusColumnForTask(task) + "\t" + task["description"] + "\n"
+
+def formatTaskAsLatex(task):
+   fullDesc = task["description"]
+   spaceIdx = fullDesc.find(" ")
+   title = "" # everything except structured label
+   if(spaceIdx>=0):
+      title = fullDesc[spaceIdx+1:]
+   # one "sub" per section above the last one
+   return "% " + fullDesc + "\n\\" + "sub"*(task["label"].depth()-1) + "section{" + title + "}\n\n\n"
+
+def writeLinesBuffered(lines,fout=None):
+   """ Writes the strings yielded by lines to fout (sys.stdout by default),
+       joining OUTPUT_CHUNK_LINES of them per write
+   """
+   if(fout==None):
+      fout = sys.stdout
+   lines = iter(lines)
+   while True:
+      chunk = list(itertools.islice(lines,OUTPUT_CHUNK_LINES))
+      if(len(chunk)==0):
+         return
+      fout.write("".join(chunk))
+      theStatistics.count("lines written",len(chunk))
+
+def openOutputFile(path):
+   """ '-' is the standard output """
+   if(path=="-"):
+      return sys.stdout
+   import codecs
+   try:
+      return codecs.open(path,"w","utf-8")
+   except IOError as e:
+      raise RuntimeError("Could not open output file '" + path + "': " + str(e))
+
 def writeUndoMessage(numCmds):
-   sys.stdout.write("twOutline issued " + str(numCmds) + " command(s) to TaskWarrior\n")
+   sys.stdout.write("twOutline made " + str(numCmds) + " change(s) to TaskWarrior\n")
    if(numCmds>0):
       sys.stdout.write("   To undo all twOutline changes run the following:\n")
       sys.stdout.write("      twOutline undo " + str(numCmds) + "\n")
+      if((OUTLINE_JOURNAL==True) and (USE_TASKWARRIOR_IMPORT==True)):
+         sys.stdout.write("   or, leaving alone the tasks changed since, run:\n")
+         sys.stdout.write("      twOutline undo-last\n")
+
+def invertOutlineIndex(paths, uuids):
+   """ Turns the idx:path and idx:uuid dictionaries returned by
+       collectOutlinePaths() and collectOutlineUUIDs() into a
+       uuid:path dictionary
+   """
+   pathsByUUID = { }
+   for ii,uuid in uuids.iteritems():
+      pathsByUUID[uuid] = paths[ii]
+   return pathsByUUID
+
+def diffOutlines(before, after):
+   """ before and after are (paths, uuids) pairs as returned by
+       collectOutlinePaths() and collectOutlineUUIDs() for the same
+       tasks. Returns the minimal list of rewrites, i.e. a
+       (uuid, oldPath, newPath) tuple for every task whose path
+       changed, in the order of the 'before' outline.
+   """
+   beforePaths,beforeUUIDs = before
+   afterPathsByUUID = invertOutlineIndex(after[0],after[1])
+   if(len(afterPathsByUUID)!=len(beforeUUIDs)):
+      raise RuntimeError("Outlines do not contain the same tasks (" + str(len(beforeUUIDs)) + " versus " + str(len(afterPathsByUUID)) + ")")
+   rewrites = [ ]
+   for ii in xrange(len(beforePaths)):
+      uuid = beforeUUIDs[ii]
+      if((uuid in afterPathsByUUID) == False):
+         raise RuntimeError("UUID '" + uuid + "' not found in new outline?")
+      afterPath = afterPathsByUUID[uuid]
+      if(beforePaths[ii]!=afterPath):
+         rewrites.append((uuid,beforePaths[ii],afterPath))
+   return rewrites
+
+class TaskWarriorChangeSet(object):
+   """ Collects the changes of an outline operation: description rewrites,
+       written with one 'export' and one 'import' per BATCH_CHUNK_SIZE
+       tasks instead of one 'modify' per task, and wait dates. The
+       changes can also be saved as a plan and applied later.
+   """
+   PLAN_FORMAT  = "twOutline"
+   PLAN_VERSION = 1
+   def __init__(self):
+      self.rewrites   = [ ] # (uuid, oldPath, newPath)
+      self.waits      = [ ] # (uuid, waitDate)
+      self.taskfilter = None # filter of the outline the changes were made in
+   def __len__(self):
+      return len(self.rewrites) + len(self.waits)
+   def addDescriptionRewrite(self,uuid,oldPath,newPath):
+      self.rewrites.append((uuid,oldPath,newPath))
+   def addWaitChange(self,uuid,waitDate):
+      self.waits.append((uuid,waitDate))
+   def isInsideSection(self,section):
+      """ True if every rewritten description is in section (a SectionLabel)
+          before and after the change
+      """
+      for uuid,oldPath,newPath in self.rewrites:
+         if((section.isPrefixOf(SectionLabel.parse(oldPath))==False) or
+            (section.isPrefixOf(SectionLabel.parse(newPath))==False)):
+            return False
+      return True
+   def apply(self,command=""):
+      """ Returns the number of modified tasks, which is also the number of
+          undos TaskWarrior needs to revert the whole change set (each
+          imported or modified task gets its own entry in the undo history).
+          The changes are journaled for 'undo-last' under command.
+      """
+      journal = None
+      if((OUTLINE_JOURNAL==True) and (USE_TASKWARRIOR_IMPORT==True)):
+         journal = [ ]
+      numCmds = self.__applyDescriptionRewrites(journal) + self.__applyWaitChanges(journal)
+      if((journal!=None) and (len(journal)>0)):
+         journalOperation(command,self.taskfilter,journal)
+      return numCmds
+   def __applyDescriptionRewrites(self,journal):
+      """ Internal utility function; not meant to be invoked """
+      theStatistics.count("descriptions rewritten",len(self.rewrites))
+      # check every description before changing anything, so that a
+      # stale plan is rejected as a whole
+      chunks = [ ]
+      for start in range(0,len(self.rewrites),BATCH_CHUNK_SIZE):
+         chunk = self.rewrites[start:start+BATCH_CHUNK_SIZE]
+         # re-export the complete records since an import replaces the task
+         recordsByUUID = exportTasksByUUID([ uuid for uuid,oldPath,newPath in chunk ])
+         records = [ ]
+         changes = [ ] # journal entries of the chunk
+         for uuid,oldPath,newPath in chunk:
+            if((uuid in recordsByUUID) == False):
+               raise RuntimeError("UUID '" + uuid + "' not found in TaskWarrior")
+            record = recordsByUUID[uuid]
+            oldDescription = record["description"]
+            record["description"] = replaceStructuredLabelInDescription(oldDescription,oldPath,newPath)
+            changes.append({ "uuid":uuid, "description":[oldDescription,record["description"]] })
+            # drop the columns TaskWarrior computes on its own
+            for column in ["id","urgency"]:
+               if(column in record):
+                  del record[column]
+            records.append(record)
+         chunks.append((records,changes))
+      if(USE_TASKWARRIOR_IMPORT==False):
+         for uuid,oldPath,newPath in self.rewrites:
+            submitTaskWarriorCommand(uuid + " modify /^" + oldPath + " /" + newPath + " /")
+         failures = flushTaskWarriorCommands()
+         writeFailedCommands(failures)
+         return len(self.rewrites) - len(failures)
+      # like a failed 'modify', a failed import is reported and neither
+      # counted nor journaled
+      numCmds = 0
+      failures = [ ]
+      for records,changes in chunks:
+         status = runTaskWarriorImport(records)
+         if(status!=0):
+            failures.append(("import of " + str(len(records)) + " task(s)",status))
+            continue
+         numCmds = numCmds + len(records)
+         if(journal!=None):
+            journal.extend(changes)
+      writeFailedCommands(failures)
+      return numCmds
+   def __applyWaitChanges(self,journal):
+      """ Internal utility function; not meant to be invoked """
+      theStatistics.count("wait dates changed",len(self.waits))
+      if(len(self.waits)==0):
+         return 0
+      uuids = [ uuid for uuid,waitDate in self.waits ]
+      if(journal!=None):
+         before = exportTasksByUUID(uuids)
+      for uuid,waitDate in self.waits:
+         submitTaskWarriorCommand(uuid + " modify wait:" + waitDate)
+      failures = flushTaskWarriorCommands()
+      writeFailedCommands(failures)
+      if(journal!=None):
+         # TaskWarrior evaluates relative dates, so read back what it stored
+         after = exportTasksByUUID(uuids)
+         for uuid in uuids:
+            if((uuid in before) and (uuid in after)):
+               old = before[uuid]
+               new = after[uuid]
+               if((old.get("wait")!=new.get("wait")) or (old.get("status")!=new.get("status"))):
+                  journal.append({ "uuid":uuid, "wait":[old.get("wait"),new.get("wait")], "status":[old.get("status"),new.get("status")] })
+      return len(self.waits) - len(failures)
+   def writePlan(self,path,command):
+      """ Saves the change set for 'twOutline apply': a header object
+          followed by one object per change, as a JSON array if path
+          ends with .json and as JSON Lines otherwise. Wait dates are
+          saved as given, so relative ones count from when the plan is
+          applied.
+      """
+      objects = [ { "plan":self.PLAN_FORMAT, "version":self.PLAN_VERSION, "command":command, "filter":self.taskfilter } ]
+      for uuid,oldPath,newPath in self.rewrites:
+         objects.append({ "uuid":uuid, "old":oldPath, "new":newPath })
+      for uuid,waitDate in self.waits:
+         objects.append({ "uuid":uuid, "wait":waitDate })
+      lines = [ json.dumps(obj,sort_keys=True) for obj in objects ]
+      try:
+         fout = open(path,"w")
+         if(path.endswith(".json")):
+            fout.write("[\n" + ",\n".join(lines) + "\n]\n")
+         else:
+            fout.write("\n".join(lines) + "\n")
+         fout.close()
+      except IOError as e:
+         raise RuntimeError("Could not write plan '" + path + "': " + str(e))
+   @staticmethod
+   def readPlan(path):
+      """ The change set saved by writePlan() """
+      try:
+         fin = open(path)
+      except IOError as e:
+         raise RuntimeError("Could not read plan '" + path + "': " + str(e))
+      try:
+         objects = iterateJSONObjects(fin)
+         header = next(objects,None)
+         if((header==None) or (header.get("plan")!=TaskWarriorChangeSet.PLAN_FORMAT)):
+            raise RuntimeError("'" + path + "' is not a twOutline plan")
+         if(header.get("version")!=TaskWarriorChangeSet.PLAN_VERSION):
+            raise RuntimeError("Plan '" + path + "' has version " + str(header.get("version")) + " but only version " + str(TaskWarriorChangeSet.PLAN_VERSION) + " is supported")
+         changeSet = TaskWarriorChangeSet()
+         changeSet.taskfilter = header.get("filter")
+         for obj in objects:
+            if(("uuid" in obj) and ("wait" in obj)):
+               changeSet.addWaitChange(obj["uuid"],obj["wait"])
+            elif(("uuid" in obj) and ("old" in obj) and ("new" in obj)):
+               changeSet.addDescriptionRewrite(obj["uuid"],obj["old"],obj["new"])
+            else:
+               raise RuntimeError("Unknown change in plan '" + path + "': " + json.dumps(obj))
+         return changeSet
+      finally:
+         fin.close()
 
-def issueTaskWarriorModifyCommandsForCompressedPaths(
+def readMoveScript(path):
+   """ The words of a 'moves' script: one '<sectionA> before|after|under
+       <sectionB>' per line, '#' starts a comment
+   """
+   try:
+      fin = open(path)
+   except IOError as e:
+      raise RuntimeError("Could not read moves '" + path + "': " + str(e))
+   words = [ ]
+   for line in fin:
+      words.extend(line.split("#",1)[0].split())
+   fin.close()
+   return words
+
+def writePlanMessage(numChanges,path):
+   sys.stdout.write("twOutline planned " + str(numChanges) + " change(s) and made none to TaskWarrior\n")
+   if(numChanges>0):
+      sys.stdout.write("   To make the changes run the following:\n")
+      sys.stdout.write("      twOutline apply " + path + "\n")
+
+def collectChangesForCompressedPaths(
    initialPaths, initialUUIDs, compressedPaths, compressedUUIDs):
    """ Compressing the outline does not change the inherent
        structure, so we can safely use the same indices to
        determine the modify commands to issue to TaskWarrior
    """
-   numCmds = 0
+   changeSet = TaskWarriorChangeSet()
    for ii,initialPath in initialPaths.iteritems():
       compressedPath = compressedPaths[ii]
       if(initialPath!=compressedPath):
-         numCmds = numCmds + 1
-         runTaskWarriorCommand(initialUUIDs[ii] + " modify /^" + initialPath + " /" + compressedPath + " /")
-   writeUndoMessage(numCmds)
+         changeSet.addDescriptionRewrite(initialUUIDs[ii], initialPath, compressedPath)
+   return changeSet
 
-def issueTaskWarriorModifyCommandsForMovedPaths(
+def collectChangesForMovedPaths(
    initialPaths, initialUUIDs, movedPaths, movedUUIDs):
    """ Moving parts of the outline will cause a structural
        change. However, if there were k tasks in the original
@@ -141,17 +1356,52 @@ def issueTaskWarriorModifyCommandsForMovedPaths(
        This code assumes that UUIDs are unique... so no checking
        is performed that they truly are.
    """
-   numCmds = 0
-   for ii,initialPath in initialPaths.iteritems():
-      initialUUID  = initialUUIDs[ii]
-      movedUUIDIdx = findFirstKeyForValueInDictionary(initialUUID,movedUUIDs)
-      if(movedUUIDIdx==None):
-         raise RuntimeError("UUID '" + initialUUID + "' not found in new outline?")
-      movedPath = movedPaths[movedUUIDIdx]
-      if(initialPath!=movedPath):
-         numCmds = numCmds + 1
-         runTaskWarriorCommand(initialUUID + " modify /^" + initialPath + " /" + movedPath + " /")
-   writeUndoMessage(numCmds)
+   changeSet = TaskWarriorChangeSet()
+   with theStatistics.span("diff outlines"):
+      rewrites = diffOutlines((initialPaths,initialUUIDs),(movedPaths,movedUUIDs))
+   for uuid,initialPath,movedPath in rewrites:
+      changeSet.addDescriptionRewrite(uuid, initialPath, movedPath)
+   return changeSet
+
+def applyOrPlanChangeSet(changeSet,opts,argv):
+   """ Applies the change set and returns the number of modified tasks;
+       with --plan the change set is only saved and None is returned
+   """
+   changeSet.taskfilter = opts.taskfilter
+   if(opts.planPath!=None):
+      changeSet.writePlan(opts.planPath,string.join(argv))
+      writePlanMessage(len(changeSet),opts.planPath)
+      return None
+   with theStatistics.span("apply changes"):
+      return changeSet.apply(string.join(argv))
+
+class SectionLabelIndex(object):
+   """ The labels of the marked sections as sorted integer tuples, with
+       the uuid of the task for each label. Sorted labels are in outline
+       order, so a range of sections is a slice found by binary search.
+   """
+   __slots__ = ["labels","uuids"]
+   def __init__(self,labels,uuids):
+      self.labels = labels # SectionLabels e.g. 1, 1.2, 1.2.1, 3
+      self.uuids  = uuids
+   def findUUIDsFromSectionToSection(self,aa,bb):
+      """ aa and bb are SectionLabels. A section belongs to the range
+          if it is not before aa and not after bb when compared up to the
+          depth of the shorter label. So the sections containing aa and
+          everything below bb are part of the range as well.
+      """
+      afterBB = bb.nextSibling() # first label after bb and its subsections
+      uuids = [ ]
+      for depth in range(1,aa.depth()):
+         ancestor = aa[0:depth]
+         if(ancestor<afterBB):
+            ii = bisect.bisect_left(self.labels,ancestor)
+            if((ii<len(self.labels)) and (self.labels[ii]==ancestor)):
+               uuids.append(self.uuids[ii])
+      start = bisect.bisect_left(self.labels,aa)
+      end   = bisect.bisect_left(self.labels,afterBB)
+      uuids.extend(self.uuids[start:end])
+      return uuids
 
 class CmdLineOptions(object):
    def printUsage(self, argv):
@@ -175,6 +1425,12 @@ class CmdLineOptions(object):
       sys.stdout.write("  -<section> has the form X or X" + OUTLINE_SEP + "Y or X" + OUTLINE_SEP + "Y" + OUTLINE_SEP + "Z etc.\n")
       sys.stdout.write("  -neither <sectionA> nor <sectionB> need to be associated with actual tasks\n")
       sys.stdout.write("\n")
+      sys.stdout.write("twOutline <filter> moves <sectionA> before|after|under <sectionB> ...\n")
+      sys.stdout.write("twOutline <filter> moves <scriptFile>\n")
+      sys.stdout.write("  -make several moves, each one in the outline left by the previous ones,\n")
+      sys.stdout.write("   and write only the net changes\n")
+      sys.stdout.write("  -<scriptFile> has one '<sectionA> before|after|under <sectionB>' per line\n")
+      sys.stdout.write("\n")
       sys.stdout.write("twOutline <filter> modify <sectionA> to <sectionB> <outlineCmd>\n")
       sys.stdout.write("  -modify tasks in the interval\n")
       sys.stdout.write("  -<section> has the form X or X" + OUTLINE_SEP + "Y or X" + OUTLINE_SEP + "Y" + OUTLINE_SEP + "Z etc.\n")
@@ -188,11 +1444,48 @@ class CmdLineOptions(object):
       sys.stdout.write("  -removes all horizontal numbering gaps in the outline\n")
       sys.stdout.write("  -numbers start from 1\n")
       sys.stdout.write("\n")
+      sys.stdout.write("twOutline --help\n")
+      sys.stdout.write("  -print this message\n")
+      sys.stdout.write("\n")
+      sys.stdout.write("twOutline apply <planFile>\n")
+      sys.stdout.write("  -make the changes saved with --plan\n")
+      sys.stdout.write("  -fails without changing anything if a planned description changed since\n")
+      sys.stdout.write("\n")
+      sys.stdout.write("twOutline undo-last\n")
+      sys.stdout.write("  -restore the tasks changed by the last compress, move(s), modify or apply\n")
+      sys.stdout.write("   with one import; tasks changed since are reported and left alone\n")
+      sys.stdout.write("\n")
+      sys.stdout.write("twOutline serve\n")
+      sys.stdout.write("  -keep outlines in memory and run the commands sent with --server\n")
+      sys.stdout.write("  -listens on the Unix socket SERVE_SOCKET\n")
+      sys.stdout.write("\n")
       sys.stdout.write("twOutline undo <numberOfTimes>\n")
       sys.stdout.write("  -issue <numberOfTimes> undos to TaskWarrior\n")
       sys.stdout.write("  -this is a convenience wrapper for TaskWarrior\n")
+      sys.stdout.write("\n")
+      sys.stdout.write("Options (anywhere on the command line):\n")
+      sys.stdout.write("  --jobs <number>\n")
+      sys.stdout.write("     -run up to <number> TaskWarrior 'modify' commands at the same time\n")
+      sys.stdout.write("  --output <file>\n")
+      sys.stdout.write("     -write the table of contents to <file> instead of the screen\n")
+      sys.stdout.write("  --pending\n")
+      sys.stdout.write("     -leave completed and deleted tasks out of the outline\n")
+      sys.stdout.write("  --plan <file>\n")
+      sys.stdout.write("     -compress, move(s) and modify save their changes to <file> (JSON Lines,\n")
+      sys.stdout.write("      or JSON if <file> ends with .json) instead of making them\n")
+      sys.stdout.write("  --server\n")
+      sys.stdout.write("     -have the running 'twOutline serve' run the command\n")
+      sys.stdout.write("     -undo always runs here, since TaskWarrior asks for a confirmation\n")
+      sys.stdout.write("  --stats text|json\n")
+      sys.stdout.write("     -print where the time went (TaskWarrior, parsing, outline steps)\n")
+      sys.stdout.write("      and counters (commands, bytes read, tasks visited) when done\n")
+      sys.stdout.write("  --profile <file>|-\n")
+      sys.stdout.write("     -also run under cProfile; '-' prints the busiest functions,\n")
+      sys.stdout.write("      otherwise the profile is saved to <file> for pstats\n")
       raise RuntimeError("") # break out of the program
    def __init__(self, argv):
+      if '--help' in argv:
+         self.printUsage(argv)
       self.taskfilter = ""
       self.cmd         = ""
       self.cmdIdx      = -1
@@ -207,6 +1500,9 @@ class CmdLineOptions(object):
       self.waitNumber  = -1 # should be positive
       self.waitUnit    = "" # should be a valid TaskWarrior unit e.g. hours, days, weeks, etc.
       self.waitCounter = 1
+      self.changeSet   = None # TaskWarriorChangeSet of modify
+      self.moves       = [ ]  # (sectionA, before|after|under, sectionB) of moves
+      self.planPath    = None # --plan <file>
       if 'compress' in argv:
          self.cmd    = "compress"
          self.cmdIdx = argv.index(self.cmd)
@@ -280,6 +1576,23 @@ class CmdLineOptions(object):
          self.sectionBIdx = self.locationIdx+1
          # and get the filter for the command
          self.taskfilter = string.join(argv[0:self.cmdIdx])
+      if 'moves' in argv:
+         # moves <sectionA> before|after|under <sectionB> [...] or moves <scriptFile>
+         self.cmd    = "moves"
+         self.cmdIdx = argv.index(self.cmd)
+         if(len(argv)-1 < self.cmdIdx+1):
+            self.printUsage(argv)
+         words = argv[self.cmdIdx+1:]
+         if(len(words)==1):
+            words = readMoveScript(words[0])
+         if((len(words)==0) or (len(words)%3!=0)):
+            raise RuntimeError("Expected moves of the form '<sectionA> before|after|under <sectionB>' but got '" + string.join(words) + "'")
+         for ii in range(0,len(words),3):
+            if(words[ii+1] not in [ "before", "after", "under" ]):
+               raise RuntimeError("Expected before, after or under in move " + str(ii/3+1) + " but got '" + words[ii+1] + "'")
+            self.moves.append((words[ii],words[ii+1],words[ii+2]))
+         # and get the filter for the command
+         self.taskfilter = string.join(argv[0:self.cmdIdx])
       if 'modify' in argv:
          # modify <sectionA> to <sectionB> <outlineCmd>
          self.cmd    = "modify"
@@ -322,9 +1635,21 @@ class CmdLineOptions(object):
                self.waitUnit   = argv[self.sectionBIdx+4]        # a valid unit e.g. hours, days, weeks, etc.
          # and get the filter for the command
          self.taskfilter = string.join(argv[0:self.cmdIdx])
+      if 'apply' in argv:
+         # apply <planFile>
+         self.cmd    = "apply"
+         self.cmdIdx = argv.index(self.cmd)
+         if(len(argv)-1 != self.cmdIdx+1):
+            self.printUsage(argv)
       if 'undo' in argv:
          self.cmd    = "undo"
          self.cmdIdx = argv.index(self.cmd)
+      if 'undo-last' in argv:
+         self.cmd    = "undo-last"
+         self.cmdIdx = argv.index(self.cmd)
+      if 'serve' in argv:
+         self.cmd    = "serve"
+         self.cmdIdx = argv.index(self.cmd)
       # if no cmd, then some kind of error
       if(self.cmd == ""):
          self.printUsage(argv)
@@ -336,349 +1661,383 @@ class CmdLineOptions(object):
       return argv[self.locationIdx]
 
 class Outline(object):
+   __slots__ = ["tasks","labelIndex","mark","idx","sections"]
    def __init__(self):
-      self.jsonObj  = None # initialized only for top level outline object
-      self.mark     = None # boolean (indicated by presence of uuid)
-      self.idx      = None # only for marked nodes
-      self.sections = None # dictionary
-   def importFromTaskWarrior(self,taskfilter):
-      self.jsonObj = runTaskWarriorCommandAndCollectJSON(taskfilter + " export")
-      self.__createOutlineFromJSON(self.jsonObj)
-      # now we've finished constructing the outline, so label the idxs
+      self.tasks      = None # uuid:task dictionary (only for top level outline object)
+      self.labelIndex = None # SectionLabelIndex (only for top level, built when needed)
+      self.mark       = None # boolean (indicated by presence of uuid)
+      self.idx        = None # only for marked nodes
+      self.sections   = None # dictionary
+   def importFromTaskWarrior(self,taskfilter,scope=(),refresh=True):
+      """ Imports the tasks of taskfilter; a non empty SectionLabel scope
+          only imports that section, its subsections and the sections
+          containing it (a partial outline, see OUTLINE_SCOPE). With
+          refresh False a cached outline is only used if TaskWarrior's
+          data files did not change since; it is never patched with the
+          tasks modified since, which misses synchronized changes.
+      """
+      if(OUTLINE_CACHE==False):
+         self.__importAllFromTaskWarrior(taskfilter,scope)
+         # now we've finished constructing the outline, so label the idxs
+         self.__assignIndicesToMarkedSections(0)
+         return
+      # take both stamps before talking to TaskWarrior so that changes
+      # made while we read are picked up by the next run
+      files = getTaskWarriorDataFileStamps()
+      stamp = time.strftime(UTC_FORMAT,time.gmtime(time.time()-1))
+      key   = OUTLINE_SEP + taskfilter
+      cache = loadOutlineCache()
+      entry = cache.get(key)
+      if((len(scope)>0) and (self.__isUpToDate(entry,files,refresh)==False)):
+         # an up to date whole outline serves any scope
+         key   = key + "\n" + str(scope)
+         entry = cache.get(key)
+      if(self.__isUpToDate(entry,files,refresh)):
+         # nothing changed in TaskWarrior since the entry was taken
+         self.tasks      = entry["tasks"]
+         self.sections   = entry["sections"]
+         self.labelIndex = entry["labels"]
+         self.__assignIndicesToMarkedSections(0)
+         return
+      refreshed = False
+      # reading the data files beats the two exports of a refresh
+      readsDataFiles = ((TASKWARRIOR_DATA_READER==True) and (compileDataFileFilter(taskfilter)!=None))
+      if((entry!=None) and (files["undo.data"]!=None) and (entry["files"]["undo.data"]!=None) and (readsDataFiles==False) and
+         (refresh==True)):
+         # an undo shrinks undo.data and restores older modification
+         # times, which an incremental refresh would miss
+         if(files["undo.data"][1]>=entry["files"]["undo.data"][1]):
+            self.tasks    = entry["tasks"]
+            self.sections = entry["sections"]
+            refreshed = self.__refreshFromTaskWarrior(taskfilter,scope,entry["stamp"])
+      if(refreshed==False):
+         self.sections = None
+         self.__importAllFromTaskWarrior(taskfilter,scope)
       self.__assignIndicesToMarkedSections(0)
-   def __createOutlineFromJSON(self,jsonObj):
+      saveOutlineCacheEntry(key,{ "tasks":self.tasks, "sections":self.sections, "labels":self.getSectionLabelIndex(), "stamp":stamp, "files":files,
+                                  "refreshed":refreshed })
+   def __isUpToDate(self,entry,files,refresh):
+      """ Internal utility function; not meant to be invoked
+          True if the cache entry can be used as it is. An entry patched
+          by a refresh may miss synchronized tasks, so it is not used
+          with refresh False.
+      """
+      return ((entry!=None) and (files["pending.data"]!=None) and (entry["files"]==files) and
+              ((refresh==True) or (entry["refreshed"]==False)) and (hasExpiredWaitDate(entry["tasks"])==False))
+   def __importAllFromTaskWarrior(self,taskfilter,scope):
+      self.tasks = { }
+      tasks = None
+      if(TASKWARRIOR_DATA_READER==True):
+         tasks = readTaskWarriorDataFiles(taskfilter,EXPORT_FIELDS)
+      if(tasks==None):
+         tasks = runTaskWarriorCommandAndCollectJSON(combineWithLabelFilter(taskfilter,scope) + " export",EXPORT_FIELDS)
+      self.__createOutlineFromJSON(tasks,scope)
+   def __refreshFromTaskWarrior(self,taskfilter,scope,since):
+      """ Patches the outline with the tasks modified after 'since'.
+          Returns False if that is not possible, because TaskWarrior may
+          have renumbered the task IDs or changed the status of a task
+          on its own.
+      """
+      if(hasExpiredWaitDate(self.tasks)):
+         return False
+      changed = list(runTaskWarriorCommandAndCollectJSON("modified.after:" + since + " export",["uuid","status"],False))
+      for task in changed:
+         if(task.get("status") in ["completed","deleted"]):
+            return False # the next garbage collection renumbers the IDs
+      if(len(changed)==0):
+         return True
+      for task in changed:
+         if(task["uuid"] in self.tasks):
+            oldTask = self.tasks.pop(task["uuid"])
+            self.__removeMarkForStructuredLabel(task["uuid"],oldTask["label"])
+            self.labelIndex = None
+      self.__createOutlineFromJSON(runTaskWarriorCommandAndCollectJSON(
+         combineWithLabelFilter(combineTaskWarriorFilters(taskfilter,"modified.after:" + since),scope) + " export",EXPORT_FIELDS,False),scope)
+      return True
+   def __removeMarkForStructuredLabel(self,uuid,label):
+      """ Internal utility function; not meant to be invoked
+          Sections left without any task are dropped, like an import
+          would never have created them.
+      """
+      path = [ ] # (section, key of the next section down)
+      section = self
+      for key in label:
+         if((section.sections==None) or ((key in section.sections) == False)):
+            return
+         path.append((section,key))
+         section = section.sections[key]
+      if(section.mark==uuid):
+         section.mark = None
+         section.idx  = None
+      while((len(path)>0) and (section.mark==None) and (section.sections==None)):
+         section,key = path.pop()
+         del section.sections[key]
+         if(len(section.sections)==0):
+            section.sections = None
+   def __createOutlineFromJSON(self,jsonObj,scope):
+      """ jsonObj may be any iterable of tasks, such as the generator
+          returned by runTaskWarriorCommandAndCollectJSON()
+      """
+      with theStatistics.span("build outline"):
+         self.__insertTasksFromJSON(jsonObj,scope)
+   def __insertTasksFromJSON(self,jsonObj,scope):
+      """ Internal utility function; not meant to be invoked """
+      scoped = (len(scope)>0)
       for task in jsonObj:
-         uuid     = task["uuid"]
-         fulldesc = task["description"]
+         uuid     = task.get("uuid")
+         fulldesc = task.get("description")
          if((uuid!=None) and (fulldesc!=None)):
-            sl = extractStringBeforeFirstSpace(fulldesc)
-            if(self.__isValidStructuredLabels(sl,sl.split(OUTLINE_SEP))==True):
-               self.insertStructuredLabel(uuid,sl)
+            label = SectionLabel.parseDescription(fulldesc)
+            if((label!=None) and ((scoped==False) or label.isInScope(scope))):
+               self.insertStructuredLabel(uuid,label)
+               task["label"] = label # parsed once, reused by every operation
+               self.tasks[uuid] = task
    def __assignIndicesToMarkedSections(self,idx):
       """ Internal utility function; not meant to be invoked """
-      if(self.mark!=None):
-         self.idx = idx
-         idx = idx + 1
-      if(self.sections!=None):
-         for key,val in self.sections.iteritems():
-            idx = val.__assignIndicesToMarkedSections(idx)
+      for section in self.listSections(ordered=False)[1]:
+         if(section.mark!=None):
+            section.idx = idx
+            idx = idx + 1
       return idx
-   def __areValidStructuredLabels(self,sl,labelsAsStrings):
-      for ll in labelsAsStrings:
-         if(ll.isdigit()==False):
-            sys.stdout.write("<section> = " + sl + "\n")
-            raise RuntimeError("<section> should be composed of digits")
-         if(int(ll)<1):
-            sys.stdout.write("<section> = " + sl + "\n")
-            raise RuntimeError("<section> should be composed of digits that are >= 1")
-   def __isValidStructuredLabels(self,sl,labelsAsStrings):
-      for ll in labelsAsStrings:
-         if(ll.isdigit()==False):
-            return False
-         # Don't check for constraints on value (do it later)
-         #if(int(ll)<1):
-         #   return False
-      return True
    def insertStructuredLabel(self,uuid,sl):
-      """ Input is a string like "1.2.3.4" """
-      labelsAsStrings = sl.split(OUTLINE_SEP)
-      self.__areValidStructuredLabels(sl,labelsAsStrings)
-      self.__insertCheckedAndSplitLabels(uuid,sl,labelsAsStrings)
-   def __insertCheckedAndSplitLabels(self,uuid,sl,labelsAsStrings):
+      """ Input is a string like "1.2.3.4" or a SectionLabel """
+      self.labelIndex = None
+      self.__insertCheckedLabel(uuid,SectionLabel.parse(sl))
+   def __insertCheckedLabel(self,uuid,label):
       """ Internal utility function; not meant to be invoked """
-      if((labelsAsStrings==None) or (len(labelsAsStrings)<1)):
-         if(self.mark!=None):
-            sys.stdout.write("<uuid>    = " + uuid + "\n")
-            sys.stdout.write("<section> = " + sl + "\n")
-            raise RuntimeError("Section already exists... trying to add a duplicate")
-         self.mark = uuid
-         return
-      if(self.sections==None):
-         self.sections = { int(labelsAsStrings[0]):Outline() }
-      else:
-         if((int(labelsAsStrings[0]) in self.sections) == False):
-            self.sections[int(labelsAsStrings[0])] = Outline()
-      child = self.sections[int(labelsAsStrings[0])]
-      child.__insertCheckedAndSplitLabels(uuid,sl,labelsAsStrings[1:])
+      section = self
+      for key in label:
+         if(section.sections==None):
+            section.sections = { }
+         child = section.sections.get(key)
+         if(child==None):
+            child = Outline()
+            section.sections[key] = child
+         section = child
+      if(section.mark!=None):
+         sys.stdout.write("<uuid>    = " + uuid + "\n")
+         sys.stdout.write("<section> = " + str(label) + "\n")
+         raise RuntimeError("Section already exists... trying to add a duplicate")
+      section.mark = uuid
+   def __findSection(self,label,depth):
+      """ Internal utility function; not meant to be invoked
+          Returns the section of the first depth numbers of label, None if
+          it is not in the outline
+      """
+      section = self
+      for pos in xrange(depth):
+         if((section.sections==None) or ((label[pos] in section.sections) == False)):
+            return None
+         section = section.sections[label[pos]]
+      return section
+   def __findParentSection(self,label):
+      """ Internal utility function; not meant to be invoked
+          Returns the section containing label, which must be in the outline
+      """
+      parent = self.__findSection(label,len(label)-1)
+      if((parent==None) or (parent.sections==None) or ((label[-1] in parent.sections) == False)):
+         raise RuntimeError("Couldn't find section '" + str(label) + "' in outline")
+      return parent
    def removeOutlineForStructuredLabel(self,sl):
-      labelsAsStrings = sl.split(OUTLINE_SEP)
-      self.__areValidStructuredLabels(sl,labelsAsStrings)
-      return self.__removeOutlineForStructuredLabel(sl,labelsAsStrings)
-   def __removeOutlineForStructuredLabel(self,sl,labelsAsStrings):
-      if((labelsAsStrings==None) or (len(labelsAsStrings)<1)):
-         raise RuntimeError("Couldn't find section '" + sl + "' in outline")
-      if(self.sections==None):
-         raise RuntimeError("Couldn't find section '" + sl + "' in outline")
-      if((int(labelsAsStrings[0]) in self.sections) == False):
-         raise RuntimeError("Couldn't find section '" + sl + "' in outline")
-      key = int(labelsAsStrings[0])
-      section = self.sections[key]
-      if(len(labelsAsStrings)==1):
-         del self.sections[key]
-         return section
-      return section.__removeOutlineForStructuredLabel(sl,labelsAsStrings[1:])
+      self.labelIndex = None
+      label  = SectionLabel.parse(sl)
+      parent = self.__findParentSection(label)
+      return parent.sections.pop(label[-1])
    def insertOutlineBeforeStructuredLabel(self,ol,sl):
-      labelsAsStrings = sl.split(OUTLINE_SEP)
-      self.__areValidStructuredLabels(sl,labelsAsStrings)
-      return self.__insertOutlineBeforeStructuredLabel(ol,sl,labelsAsStrings)
-   def __insertOutlineBeforeStructuredLabel(self,ol,sl,labelsAsStrings):
-      if((labelsAsStrings==None) or (len(labelsAsStrings)<1)):
-         raise RuntimeError("Couldn't find section '" + sl + "' in outline")
-      if(self.sections==None):
-         raise RuntimeError("Couldn't find section '" + sl + "' in outline")
-      if((int(labelsAsStrings[0]) in self.sections) == False):
-         raise RuntimeError("Couldn't find section '" + sl + "' in outline")
-      if(len(labelsAsStrings)==1):
-         sortedSectionKeys = sorted(self.sections.keys())
-         keyToInsertBefore = int(labelsAsStrings[0])
-         if(((keyToInsertBefore-1)>=1) and (keyToInsertBefore-1 in sortedSectionKeys)):
-            # if the previous section doesn't have any marked subsections
-            # then it is safe to delete it
-            prevOl = self.sections[keyToInsertBefore-1]
-            if(prevOl.__hasAtLeastOneMarkedSection()==False):
-               del self.sections[keyToInsertBefore-1]
-               sortedSectionKeys = sorted(self.sections.keys()) # update deletion
-         if(((keyToInsertBefore-1)<1) or (keyToInsertBefore-1 in sortedSectionKeys)):
-            # insert at the current location since we couldn't put before
-            # and then MAY need to shift down
-            startIdx = sortedSectionKeys.index(keyToInsertBefore)
-            endIdx = self.__findLastConsecutiveSectionIndexAfter(sortedSectionKeys,startIdx)
-            endIdx = endIdx + 1 # to make correct slice add 1
-            shiftKeysReversed = sortedSectionKeys[startIdx:endIdx]
-            shiftKeysReversed.reverse() # inplace reverse
-            for shiftKey in shiftKeysReversed: # consider last one first
-               tmp = self.sections[shiftKey]
-               del self.sections[shiftKey]
-               self.sections[shiftKey+1] = tmp
-            self.sections[keyToInsertBefore] = ol
-         else:
-            # can insert before
-            self.sections[keyToInsertBefore-1] = ol
+      self.labelIndex = None
+      label  = SectionLabel.parse(sl)
+      parent = self.__findParentSection(label)
+      keyToInsertBefore = label[-1]
+      if(((keyToInsertBefore-1)>=1) and (keyToInsertBefore-1 in parent.sections)):
+         # if the previous section doesn't have any marked subsections
+         # then it is safe to delete it
+         prevOl = parent.sections[keyToInsertBefore-1]
+         if(prevOl.__hasAtLeastOneMarkedSection()==False):
+            del parent.sections[keyToInsertBefore-1]
+      if(((keyToInsertBefore-1)<1) or (keyToInsertBefore-1 in parent.sections)):
+         # no gap before, so some siblings have to be renumbered
+         parent.__insertSectionAfterKey(ol,keyToInsertBefore-1)
       else:
-         recursionKey = int(labelsAsStrings[0])
-         section = self.sections[recursionKey]
-         section.__insertOutlineBeforeStructuredLabel(ol,sl,labelsAsStrings[1:])
+         # can insert before
+         parent.sections[keyToInsertBefore-1] = ol
    def insertOutlineAfterStructuredLabel(self,ol,sl):
-      labelsAsStrings = sl.split(OUTLINE_SEP)
-      self.__areValidStructuredLabels(sl,labelsAsStrings)
-      return self.__insertOutlineAfterStructuredLabel(ol,sl,labelsAsStrings)
-   def __insertOutlineAfterStructuredLabel(self,ol,sl,labelsAsStrings):
-      if((labelsAsStrings==None) or (len(labelsAsStrings)<1)):
-         raise RuntimeError("Couldn't find section '" + sl + "' in outline")
-      if(self.sections==None):
-         raise RuntimeError("Couldn't find section '" + sl + "' in outline")
-      if((int(labelsAsStrings[0]) in self.sections) == False):
-         raise RuntimeError("Couldn't find section '" + sl + "' in outline")
-      if(len(labelsAsStrings)==1):
-         sortedSectionKeys = sorted(self.sections.keys())
-         keyToInsertAfter = int(labelsAsStrings[0])
-         if(keyToInsertAfter+1 in sortedSectionKeys):
-            # if the next section doesn't have any marked subsections
-            # then it is safe to delete it
-            nextOl = self.sections[keyToInsertAfter+1]
-            if(nextOl.__hasAtLeastOneMarkedSection()==False):
-               del self.sections[keyToInsertAfter+1]
-               sortedSectionKeys = sorted(self.sections.keys()) # update deletion
-         if(keyToInsertAfter+1 in sortedSectionKeys):
-            # insert at the current location since we couldn't put before
-            # and then MAY need to shift down
-            startIdx = sortedSectionKeys.index(keyToInsertAfter+1)
-            endIdx = self.__findLastConsecutiveSectionIndexAfter(sortedSectionKeys,startIdx)
-            endIdx = endIdx + 1 # to make correct slice add 1
-            shiftKeysReversed = sortedSectionKeys[startIdx:endIdx]
-            shiftKeysReversed.reverse() # inplace reverse
-            for shiftKey in shiftKeysReversed: # consider last one first
-               tmp = self.sections[shiftKey]
-               del self.sections[shiftKey]
-               self.sections[shiftKey+1] = tmp
-            self.sections[keyToInsertAfter+1] = ol
-         else:
-            # can insert after
-            self.sections[keyToInsertAfter+1] = ol
-      else:
-         recursionKey = int(labelsAsStrings[0])
-         section = self.sections[recursionKey]
-         section.__insertOutlineAfterStructuredLabel(ol,sl,labelsAsStrings[1:])
+      self.labelIndex = None
+      label  = SectionLabel.parse(sl)
+      parent = self.__findParentSection(label)
+      keyToInsertAfter = label[-1]
+      if(keyToInsertAfter+1 in parent.sections):
+         # if the next section doesn't have any marked subsections
+         # then it is safe to delete it
+         nextOl = parent.sections[keyToInsertAfter+1]
+         if(nextOl.__hasAtLeastOneMarkedSection()==False):
+            del parent.sections[keyToInsertAfter+1]
+      parent.__insertSectionAfterKey(ol,keyToInsertAfter)
    def insertOutlineUnderStructuredLabel(self,ol,sl):
-      labelsAsStrings = sl.split(OUTLINE_SEP)
-      self.__areValidStructuredLabels(sl,labelsAsStrings)
-      return self.__insertOutlineUnderStructuredLabel(ol,sl,labelsAsStrings)
-   def __insertOutlineUnderStructuredLabel(self,ol,sl,labelsAsStrings):
-      if((labelsAsStrings==None) or (len(labelsAsStrings)==0)):
-         if(self.sections==None):
-            self.sections = { 1:ol }
-         else:
-            if((1 in self.sections) == False):
-               self.sections[1] = ol
-            else:
-               sortedSectionKeys = sorted(self.sections.keys())
-               keyToInsertBefore = 1
-               # insert at the current location since we couldn't put before
-               # and then MAY need to shift down
-               startIdx = sortedSectionKeys.index(keyToInsertBefore)
-               endIdx = self.__findLastConsecutiveSectionIndexAfter(sortedSectionKeys,startIdx)
-               endIdx = endIdx + 1 # to make correct slice
-               shiftKeysReversed = sortedSectionKeys[startIdx:endIdx]
-               shiftKeysReversed.reverse() # inplace reverse
-               for shiftKey in shiftKeysReversed: # consider last one first
-                  tmp = self.sections[shiftKey]
-                  del self.sections[shiftKey]
-                  self.sections[shiftKey+1] = tmp
-               self.sections[keyToInsertBefore] = ol
+      self.labelIndex = None
+      label   = SectionLabel.parse(sl)
+      section = self.__findSection(label,len(label))
+      if(section==None):
+         raise RuntimeError("Couldn't find section '" + str(label) + "' in outline")
+      if(section.sections==None):
+         section.sections = { 1:ol }
       else:
-         recursionKey = int(labelsAsStrings[0])
-         section = self.sections[recursionKey]
-         section.__insertOutlineUnderStructuredLabel(ol,sl,labelsAsStrings[1:])
-   def __findLastConsecutiveSectionIndexAfter(self,sortedKeys,startIdx):
-      """ Given 2,3,4,6 as keys and 1 as startIdx then return 2 as endIdx """
-      sortedKeys2 = sortedKeys[startIdx:]
-      endIdx = startIdx
-      for ii,vv in enumerate(sortedKeys2):
-         if(ii+1 < len(sortedKeys2)):
-            if(sortedKeys2[ii+1] == (sortedKeys2[ii]+1)):
-               endIdx = endIdx + 1
-            else:
-               break
-      return endIdx
-   def isStructuredLabelInOutline(self,sl):
-      """ Input is a string like "1.2.3.4" """
-      labelsAsStrings = sl.split(OUTLINE_SEP)
-      self.__areValidStructuredLabels(sl,labelsAsStrings)
-      return self.__isStructuredLabelInOutline(sl,labelsAsStrings)
-   def __isStructuredLabelInOutline(self,sl,labelsAsStrings):
+         section.__insertSectionAfterKey(ol,0)
+   def __insertSectionAfterKey(self,ol,key):
+      """ Internal utility function; not meant to be invoked
+          Inserts ol right after the subsection key (0 means as the first
+          subsection). If key+1 is taken, either the run of consecutive
+          subsections starting at key+1 moves up by one, or the run ending
+          at key moves down by one into the gap before it. Every task in a
+          moved subsection is renumbered (one change to TaskWarrior each),
+          so the run holding fewer tasks is moved; on a tie the run above
+          moves, as it always did.
+      """
+      if((key+1 in self.sections) == False):
+         self.sections[key+1] = ol
+         return
+      upLast = self.__findEndOfRunOfSections(key+1,1)
+      upCost = self.__countTasksInSections(key+1,upLast)
+      if(key>=1):
+         downFirst = self.__findEndOfRunOfSections(key,-1)
+         if((downFirst>1) and (self.__countTasksInSections(downFirst,key)<upCost)):
+            self.__shiftSections(downFirst,key,-1)
+            self.sections[key] = ol
+            return
+      self.__shiftSections(key+1,upLast,1)
+      self.sections[key+1] = ol
+   def __findEndOfRunOfSections(self,key,step):
+      """ Internal utility function; not meant to be invoked
+          Given 2,3,4,6 as keys, 2 as key and 1 as step then return 4;
+          the cost is the length of the run, the keys are never sorted
+      """
+      while((key+step) in self.sections):
+         key = key + step
+      return key
+   def __countTasksInSections(self,firstKey,lastKey):
       """ Internal utility function; not meant to be invoked """
-      if((labelsAsStrings==None) or (len(labelsAsStrings)<1)):
-         return True
-      if(self.sections==None):
-         return False
-      if((int(labelsAsStrings[0]) in self.sections) == False):
-         return False
-      child = self.sections[int(labelsAsStrings[0])]
-      return child.__isStructuredLabelInOutline(sl,labelsAsStrings[1:])
-   def printOutlineAsText(self):
-      subsectionKeys = sorted(self.sections.keys())
-      for key in subsectionKeys:
-         subsection = self.sections[key]
-         subsection.__printOutlineAsText(self.jsonObj)
-   def __printOutlineAsText(self,jsonObj):
-      # jsonObj is only kept inside Outline object at top-level
-      if(self.mark!=None):
-         fullDesc  = self.__getFullDescriptionForUUID(self.mark,jsonObj)
-         theID     = self.__getIDForUUID(self.mark,jsonObj)
-         theStatus = self.__getStatusForUUID(self.mark,jsonObj)
-         sys.stdout.write(str(theID) + "\t" + theStatus + "\t" + fullDesc + "\n")
-      if(self.sections!=None):
-         subsectionKeys = sorted(self.sections.keys())
-         for key in subsectionKeys:
-            subsection = self.sections[key]
-            subsection.__printOutlineAsText(jsonObj)
-   def printOutlineAsLatex(self):
-      subsectionKeys = sorted(self.sections.keys())
-      for key in subsectionKeys:
-         subsection = self.sections[key]
-         subsection.__printOutlineAsLatex(self.jsonObj)
-   def __printOutlineAsLatex(self,jsonObj):
-      # jsonObj is only kept inside Outline object at top-level
+      numTasks = 0
+      for key in range(firstKey,lastKey+1):
+         numTasks = numTasks + self.sections[key].__countTasks()
+      return numTasks
+   def __countTasks(self):
+      """ Internal utility function; not meant to be invoked """
+      numTasks = 0
       if(self.mark!=None):
-         fullDesc = self.__getFullDescriptionForUUID(self.mark,jsonObj)
-         sys.stdout.write("% " + fullDesc + "\n")
-         sl = extractStringBeforeFirstSpace(fullDesc)
-         labelsAsStrings = sl.split(OUTLINE_SEP)
-         sys.stdout.write("\\")
-         for sec in labelsAsStrings[0:(len(labelsAsStrings)-1)]: # not last section
-            sys.stdout.write("sub")
-         sys.stdout.write("section{")
-         sys.stdout.write(fullDesc[(len(sl)+1):]) # everything except structured label
-         sys.stdout.write("}\n\n\n")
-      if(self.sections!=None):
-         subsectionKeys = sorted(self.sections.keys())
-         for key in subsectionKeys:
-            subsection = self.sections[key]
-            subsection.__printOutlineAsLatex(jsonObj)
-   def __getFullDescriptionForUUID(self,uuid,jsonObj):
-      for task in jsonObj:
-         taskUUID = task["uuid"]
-         if(taskUUID==uuid):
-            return task["description"]
-      raise RuntimeError("Implementation problem!\nuuid " + uuid + " not found in TaskWarrior")
-   def __getIDForUUID(self,uuid,jsonObj):
-      for task in jsonObj:
-         taskUUID = task["uuid"]
-         if(taskUUID==uuid):
-            return task["id"]
-      raise RuntimeError("Implementation problem!\nuuid " + uuid + " not found in TaskWarrior")
-   def __getStatusForUUID(self,uuid,jsonObj):
-      for task in jsonObj:
-         taskUUID = task["uuid"]
-         if(taskUUID==uuid):
-            status = task["status"]
-            if(status=="completed"):
-               status = status + "\t" # add an extra tab so things line up
-            if(status=="pending"):
-               status = "\t\t"        # add an extra tab so things line up
-            if(status=="waiting"):
-               status = convertUTCTimeStringToLocalTimeString(task["wait"])
-            return status
-      raise RuntimeError("Implementation problem!\nuuid " + uuid + " not found in TaskWarrior")
-   def printOutlineForDebugging(self):
-      sys.stdout.write("Outline:\n")
-      subsectionKeys = sorted(self.sections.keys())
-      for key in subsectionKeys:
-         val = self.sections[key]
-         val.__printOutline(3,str(key))
-   def __printOutline(self,indent,path):
+         numTasks = 1
+      for section in self.listSections(ordered=False)[1]:
+         if(section.mark!=None):
+            numTasks = numTasks + 1
+      return numTasks
+   def __shiftSections(self,firstKey,lastKey,step):
       """ Internal utility function; not meant to be invoked
-          indent is a number specifying how many chars to indent
+          Renumbers the subsections firstKey..lastKey by step (+1 or -1);
+          the key the run moves into must be free
       """
-      if(self.mark!=None):
-         sys.stdout.write(" "*indent + path + " uuid:" + self.mark + " idx:" + str(self.idx) + "\n")
-      if(self.sections != None):
-         subsectionKeys = sorted(self.sections.keys())
-         for key in subsectionKeys:
-            val = self.sections[key]
-            val.__printOutline(indent, path+OUTLINE_SEP+str(key))
+      keys = range(firstKey,lastKey+1)
+      if(step>0):
+         keys.reverse() # consider last one first
+      for key in keys:
+         self.sections[key+step] = self.sections.pop(key)
+   def isStructuredLabelInOutline(self,sl):
+      """ Input is a string like "1.2.3.4" or a SectionLabel """
+      label = SectionLabel.parse(sl)
+      return (self.__findSection(label,len(label))!=None)
+   def printOutlineAsText(self,fout=None):
+      writeLinesBuffered(itertools.imap(formatTaskAsText,self.iterateMarkedTasks()),fout)
+   def printOutlineAsLatex(self,fout=None):
+      writeLinesBuffered(itertools.imap(formatTaskAsLatex,self.iterateMarkedTasks()),fout)
+   def iterateMarkedTasks(self):
+      """ Generator yielding the tasks of the marked sections in outline order """
+      # tasks is only kept inside Outline object at top-level
+      tasks = self.tasks
+      for section in self.listSections()[1]:
+         if(section.mark!=None):
+            if((section.mark in tasks) == False):
+               raise RuntimeError("Implementation problem!\nuuid " + section.mark + " not found in TaskWarrior")
+            yield tasks[section.mark]
+   def listSections(self,extendLabel=None,label=None,ordered=True):
+      """ Returns (labels, sections): every section below this one, in
+          outline order unless ordered is False, and its label. The labels
+          of the subsections keys of a section are extendLabel(label of
+          the section, keys), starting from label; without extendLabel
+          labels is None. The
+          traversal shared by all operations: it uses an explicit stack
+          instead of recursion, so deep outlines do not hit Python's
+          recursion limit and no function is called per section.
+      """
+      labels   = None
+      sections = [ ]
+      if(extendLabel!=None):
+         labels = [ ]
+      if(ordered==False):
+         # level by level, which needs no stack at all
+         level       = [ self ]
+         levelLabels = [ label ]
+         while(len(level)>0):
+            nextLevel       = [ ]
+            nextLevelLabels = [ ]
+            for ii,section in enumerate(level):
+               subsections = section.sections
+               if(subsections!=None):
+                  if(extendLabel==None):
+                     nextLevel.extend(subsections.itervalues())
+                  else:
+                     keys = subsections.keys()
+                     nextLevel.extend([ subsections[key] for key in keys ])
+                     nextLevelLabels.extend(extendLabel(levelLabels[ii],keys))
+            sections.extend(nextLevel)
+            if(extendLabel!=None):
+               labels.extend(nextLevelLabels)
+            level       = nextLevel
+            levelLabels = nextLevelLabels
+         return (labels,sections)
+      stack       = [ self ] # sections still to be listed, the next one last
+      stackLabels = [ label ]
+      while(len(stack)>0):
+         section = stack.pop()
+         if(extendLabel!=None):
+            label = stackLabels.pop()
+         if(section is not self):
+            sections.append(section)
+            if(extendLabel!=None):
+               labels.append(label)
+         subsections = section.sections
+         if(subsections!=None):
+            # pushed last to first so that they are popped in order
+            keys = sorted(subsections,reverse=True)
+            stack.extend([ subsections[key] for key in keys ])
+            if(extendLabel!=None):
+               stackLabels.extend(extendLabel(label,keys))
+      return (labels,sections)
+   def printOutlineForDebugging(self):
+      sys.stdout.write("Outline:\n")
+      paths,sections = self.listSections(extendPaths,"")
+      for path,section in itertools.izip(paths,sections):
+         if(section.mark!=None):
+            sys.stdout.write("   " + path + " uuid:" + section.mark + " idx:" + str(section.idx) + "\n")
    def collectOutlinePaths(self):
       allPaths = { } # idx:path
       if(self.sections==None or self.sections.keys()==None):
          raise RuntimeError("No tasks seem to have a hierarchy associated to them (e.g. X or X.Y or X.Y.Z etc.)")
-      subsectionKeys = sorted(self.sections.keys())
-      for key in subsectionKeys:
-         val = self.sections[key]
-         allPaths = val.__collectOutlinePaths(str(key),allPaths)
-      return allPaths
-   def __collectOutlinePaths(self,currPath,allPaths):
-      """ Internal utility function; not meant to be invoked """
-      if(self.mark!=None):
-         allPaths[self.idx] = currPath
-      if(self.sections != None):
-         subsectionKeys = sorted(self.sections.keys())
-         for key in subsectionKeys:
-            val = self.sections[key]
-            allPaths = val.__collectOutlinePaths(currPath+OUTLINE_SEP+str(key),allPaths)
+      paths,sections = self.listSections(extendPaths,"",False)
+      for path,section in itertools.izip(paths,sections):
+         if(section.mark!=None):
+            allPaths[section.idx] = path
       return allPaths
    def collectOutlineUUIDs(self):
       allUUIDs = { } # idx:uuid
-      subsectionKeys = sorted(self.sections.keys())
-      for key in subsectionKeys:
-         val = self.sections[key]
-         allUUIDs = val.__collectOutlineUUIDs(allUUIDs)
-      return allUUIDs
-   def __collectOutlineUUIDs(self,allUUIDs):
-      """ Internal utility function; not meant to be invoked """
-      if(self.mark!=None):
-         allUUIDs[self.idx] = self.mark
-      if(self.sections != None):
-         subsectionKeys = sorted(self.sections.keys())
-         for key in subsectionKeys:
-            val = self.sections[key]
-            allUUIDs = val.__collectOutlineUUIDs(allUUIDs)
+      for section in self.listSections(ordered=False)[1]:
+         if(section.mark!=None):
+            allUUIDs[section.idx] = section.mark
       return allUUIDs
    def compressOutline(self):
+      self.labelIndex = None
       if(self.sections==None):
          return
       self.__createCompressedLabelsForSubsections()
-      for key,val in self.sections.iteritems():
-         val.compressOutline()
+      for section in self.listSections(ordered=False)[1]:
+         if(section.sections!=None):
+            section.__createCompressedLabelsForSubsections()
    def __createCompressedLabelsForSubsections(self):
       """ Internal utility function; not meant to be invoked
           replace original keys with new key values
@@ -689,130 +2048,454 @@ class Outline(object):
          del self.sections[oldkey]
          self.sections[ii+1] = oldval # python is 0-based and I want 1-based labels
    def __hasAtLeastOneMarkedSection(self):
-      if(self.mark!=None):
-         return True
-      if(self.sections!=None):
-         for key,val in self.sections.iteritems():
-            hasMarked = val.__hasAtLeastOneMarkedSection()
-            if(hasMarked==True):
+      """ Internal utility function; not meant to be invoked
+          Looks level by level and stops at the first marked section
+      """
+      level = [ self ]
+      while(len(level)>0):
+         nextLevel = [ ]
+         for section in level:
+            if(section.mark!=None):
                return True
+            if(section.sections!=None):
+               nextLevel.extend(section.sections.itervalues())
+         level = nextLevel
       return False
+   def getSectionLabelIndex(self):
+      if(self.labelIndex==None):
+         labels = [ ]
+         uuids  = [ ]
+         for label,section in itertools.izip(*self.listSections(SectionLabel.children,SectionLabel(()))):
+            if(section.mark!=None):
+               labels.append(label)
+               uuids.append(section.mark)
+         self.labelIndex = SectionLabelIndex(labels,uuids)
+      return self.labelIndex
+   def __getstate__(self):
+      """ Pickles the section and everything below it as a flat list of
+          (depth, key, mark, idx) in outline order; pickling the nested
+          sections would recurse once per level
+      """
+      flat = [ ]
+      for (depth,key),section in itertools.izip(*self.listSections(lambda parent,keys: [ (parent[0]+1,key) for key in keys ],(0,None))):
+         flat.append((depth,key,section.mark,section.idx))
+      return (self.tasks,self.labelIndex,self.mark,self.idx,flat)
+   def __setstate__(self,state):
+      self.tasks,self.labelIndex,self.mark,self.idx,flat = state
+      self.sections = None
+      parents = [ self ] # parents[d] is the last section of depth d
+      for depth,key,mark,idx in flat:
+         section = Outline()
+         section.mark = mark
+         section.idx  = idx
+         parent = parents[depth-1]
+         if(parent.sections==None):
+            parent.sections = { }
+         parent.sections[key] = section
+         del parents[depth:]
+         parents.append(section)
    # The passed function will be invoked like this:
    #    fcn(taskUUID, taskID, taskDesc, taskStatus, userData)
    # whenever the task should be visited.
    def visitFromSectionToSection(self,aa,bb,fcn,userData):
-      numberOfVisits = 0
-      aaLabelsAsStrings = aa.split(OUTLINE_SEP)
-      bbLabelsAsStrings = bb.split(OUTLINE_SEP)
-      #print aaLabelsAsStrings
-      #print bbLabelsAsStrings
-      aaStart = int(aaLabelsAsStrings[0])
-      bbStart = int(bbLabelsAsStrings[0])
-      #print "interval [" + str(aaStart) + ".." + str(bbStart) + "]"
-      #
-      subsectionKeys = sorted(self.sections.keys())
-      for key in subsectionKeys:
-         if((key>=aaStart) and (key<=bbStart)):
-            #print "Visiting " + str(key)
-            subsection = self.sections[key]
-            numberOfVisits += subsection.__visitFromSectionToSection(self.jsonObj,aaLabelsAsStrings,bbLabelsAsStrings,1,fcn,userData)
-      return numberOfVisits
-   def __visitFromSectionToSection(self,jsonObj,aaLabelsAsStrings,bbLabelsAsStrings,depth,fcn,userData):
-      # jsonObj is only kept inside Outline object at top-level
-      # Debugging
-      #print "depth = " + str(depth)
-      ###
-      numberOfVisits = 0
-      if(self.mark!=None):
-         # is it ok to output this one? i.e. are we after the start and before the end?
-         fullDesc  = self.__getFullDescriptionForUUID(self.mark,jsonObj)
-         if(self.__isTaskAfterStartInHierarchy(fullDesc,aaLabelsAsStrings,depth)==True):
-            if(self.__isTaskBeforeEndInHierarchy(fullDesc,bbLabelsAsStrings,depth)==True):
-               theID     = self.__getIDForUUID(self.mark,jsonObj)
-               theStatus = self.__getStatusForUUID(self.mark,jsonObj)
-               fcn(self.mark, theID, fullDesc, theStatus, userData)
-               numberOfVisits += 1
-      if(self.sections!=None):
-         subsectionKeys = sorted(self.sections.keys())
-         for key in subsectionKeys:
-            # TODO: probably could optimize a little bit here... i.e. if key is out of interval...
-            subsection = self.sections[key]
-            numberOfVisits += subsection.__visitFromSectionToSection(jsonObj,aaLabelsAsStrings,bbLabelsAsStrings,depth+1,fcn,userData)
-      return numberOfVisits
-   def __isTaskAfterStartInHierarchy(self,taskFullDesc,start,depth):
-         sl              = extractStringBeforeFirstSpace(taskFullDesc)
-         labelsAsStrings = sl.split(OUTLINE_SEP)
-         # Debugging
-         #print "sl = " + sl
-         #print labelsAsStrings
-         #print "len(start)           = " + str(len(start))
-         #print "len(labelsAsStrings) = " + str(len(labelsAsStrings))
-         ###
-         if(depth > len(start)):
-            #print "depth > len(start)"
-            #print "Return True"
-            return True
-         if(depth > len(labelsAsStrings)):
-            #print "depth > len(labelsAsStrings)"
-            #print "Return True"
-            return True
-         equalCnt = 0
-         for ii in range(depth):
-            if(int(labelsAsStrings[ii]) > int(start[ii])):
-               #print "int(labelsAsStrings[" + str(ii) + "]) > int(start[" + str(ii) + "])"
-               #print "   i.e. " + labelsAsStrings[ii] + " > " + start[ii]
-               #print "Return True"
-               return True
-            if(int(labelsAsStrings[ii]) == int(start[ii])):
-               equalCnt = equalCnt + 1
-         if(equalCnt==depth):
-            #print "equalCnt==depth"
-            #print "Return True"
-            return True
-         #print "Return False"
-         return False
-   def __isTaskBeforeEndInHierarchy(self,taskFullDesc,end,depth):
-         sl              = extractStringBeforeFirstSpace(taskFullDesc)
-         labelsAsStrings = sl.split(OUTLINE_SEP)
-         # Debugging
-         #print "sl = " + sl
-         #print labelsAsStrings
-         #print "len(end)             = " + str(len(end))
-         #print "len(labelsAsStrings) = " + str(len(labelsAsStrings))
-         ###
-         if(depth > len(end)):
-            #print "depth > len(end)"
-            #print "Return True"
-            return True
-         if(depth > len(labelsAsStrings)):
-            #print "depth > len(labelsAsStrings)"
-            #print "Return True"
-            return True
-         equalCnt = 0
-         for ii in range(depth):
-            if(int(labelsAsStrings[ii]) < int(end[ii])):
-               #print "int(labelsAsStrings[" + str(ii) + "]) < int(end[" + str(ii) + "])"
-               #print "   i.e. " + labelsAsStrings[ii] + " < " + end[ii]
-               #print "Return True"
-               return True
-            if(int(labelsAsStrings[ii]) == int(end[ii])):
-               equalCnt = equalCnt + 1
-         if(equalCnt==depth):
-            #print "equalCnt==depth"
-            #print "Return True"
-            return True
-         #print "Return False"
+      return visitTasksFromSectionToSection(self.tasks,self.getSectionLabelIndex(),aa,bb,fcn,userData)
+
+def visitTasksFromSectionToSection(tasks,labelIndex,aa,bb,fcn,userData):
+   """ Shared by the outline engines; only the tasks in the range are
+       looked at
+   """
+   return visitTasks(tasks,labelIndex.findUUIDsFromSectionToSection(SectionLabel.parse(aa),SectionLabel.parse(bb)),fcn,userData)
+
+def visitTasks(tasks,uuids,fcn,userData):
+   """ Calls fcn for the tasks of uuids, in that order """
+   numberOfVisits = 0
+   for uuid in uuids:
+      task = tasks[uuid]
+      fcn(uuid, task["id"], task["description"], getStatusColumnForTask(task), userData)
+      numberOfVisits += 1
+   theStatistics.count("tasks visited",numberOfVisits)
+   return numberOfVisits
+
+class CompactOutline(object):
+   """ Flat version of Outline offering the same public methods. The
+       sections are kept in pre-order, which is also the sorted order of
+       their labels, in parallel columns:
+          keys[i]    - number of section i inside its parent section
+          depths[i]  - 1 for top level sections
+          parents[i] - row of the parent section, -1 for top level sections
+          ends[i]    - one past the last row of the subtree of section i
+          marks[i]   - uuid of the task labelled by section i or None
+       Walking the outline is then a loop over rows instead of sorting the
+       keys of a dictionary at every node. The structural changes of a
+       'move' are rare and done on a temporary Outline. Imports go through
+       an Outline as well (and its cache), which is dropped afterwards.
+   """
+   __slots__ = ["tasks","labelIndex","keys","depths","parents","ends","marks"]
+   def __init__(self):
+      self.tasks      = None # uuid:task dictionary
+      self.labelIndex = None # SectionLabelIndex, built when needed
+      self.keys    = array.array("i")
+      self.depths  = array.array("i")
+      self.parents = array.array("i")
+      self.ends    = array.array("i")
+      self.marks   = [ ]
+   def importFromTaskWarrior(self,taskfilter,scope=(),refresh=True):
+      ol = Outline()
+      ol.importFromTaskWarrior(taskfilter,scope,refresh)
+      self.__fromOutline(ol)
+      self.labelIndex = ol.getSectionLabelIndex()
+   def __fromOutline(self,ol):
+      """ Internal utility function; not meant to be invoked """
+      self.__init__()
+      self.tasks = ol.tasks
+      if(ol.sections==None):
+         return
+      # (key, section, depth, parent row) or (None, row) to close a subtree
+      stack = [ (key,ol.sections[key],1,-1) for key in sorted(ol.sections.keys(),reverse=True) ]
+      while(len(stack)>0):
+         item = stack.pop()
+         if(item[0]==None):
+            self.ends[item[1]] = len(self.keys)
+            continue
+         key,section,depth,parent = item
+         row = len(self.keys)
+         self.keys.append(key)
+         self.depths.append(depth)
+         self.parents.append(parent)
+         self.ends.append(0)
+         self.marks.append(section.mark)
+         stack.append((None,row))
+         if(section.sections!=None):
+            for subkey in sorted(section.sections.keys(),reverse=True):
+               stack.append((subkey,section.sections[subkey],depth+1,row))
+   def toOutline(self):
+      """ Returns the equivalent Outline """
+      ol = Outline()
+      ol.tasks = self.tasks
+      sections = [ ]
+      idx = 0
+      for row in xrange(len(self.keys)):
+         section = Outline()
+         if(self.marks[row]!=None):
+            section.mark = self.marks[row]
+            section.idx  = idx
+            idx = idx + 1
+         parent = ol
+         if(self.parents[row]>=0):
+            parent = sections[self.parents[row]]
+         if(parent.sections==None):
+            parent.sections = { }
+         parent.sections[self.keys[row]] = section
+         sections.append(section)
+      return ol
+   def __findRowForStructuredLabel(self,sl):
+      """ Internal utility function; not meant to be invoked
+          returns -1 if the section is not in the outline
+      """
+      row   = -1
+      first = 0
+      end   = len(self.keys)
+      for key in SectionLabel.parse(sl):
+         # hop from sibling to sibling over their subtrees
+         row = first
+         while((row<end) and (self.keys[row]!=key)):
+            row = self.ends[row]
+         if(row>=end):
+            return -1
+         first = row + 1
+         end   = self.ends[row]
+      return row
+   def isStructuredLabelInOutline(self,sl):
+      """ Input is a string like "1.2.3.4" """
+      return (self.__findRowForStructuredLabel(sl)>=0)
+   def removeOutlineForStructuredLabel(self,sl):
+      ol = self.toOutline()
+      section = ol.removeOutlineForStructuredLabel(sl)
+      self.__fromOutline(ol)
+      return section
+   def insertOutlineBeforeStructuredLabel(self,section,sl):
+      ol = self.toOutline()
+      ol.insertOutlineBeforeStructuredLabel(section,sl)
+      self.__fromOutline(ol)
+   def insertOutlineAfterStructuredLabel(self,section,sl):
+      ol = self.toOutline()
+      ol.insertOutlineAfterStructuredLabel(section,sl)
+      self.__fromOutline(ol)
+   def insertOutlineUnderStructuredLabel(self,section,sl):
+      ol = self.toOutline()
+      ol.insertOutlineUnderStructuredLabel(section,sl)
+      self.__fromOutline(ol)
+   def __getTaskForRow(self,row):
+      """ Internal utility function; not meant to be invoked """
+      if((self.marks[row] in self.tasks) == False):
+         raise RuntimeError("Implementation problem!\nuuid " + self.marks[row] + " not found in TaskWarrior")
+      return self.tasks[self.marks[row]]
+   def printOutlineAsText(self,fout=None):
+      writeLinesBuffered(itertools.imap(formatTaskAsText,self.iterateMarkedTasks()),fout)
+   def printOutlineAsLatex(self,fout=None):
+      writeLinesBuffered(itertools.imap(formatTaskAsLatex,self.iterateMarkedTasks()),fout)
+   def iterateMarkedTasks(self):
+      """ Generator yielding the tasks of the marked sections in outline order """
+      for row in xrange(len(self.keys)):
+         if(self.marks[row]!=None):
+            yield self.__getTaskForRow(row)
+   def printOutlineForDebugging(self):
+      sys.stdout.write("Outline:\n")
+      paths = self.collectOutlinePaths()
+      uuids = self.collectOutlineUUIDs()
+      for idx in xrange(len(paths)):
+         sys.stdout.write("   " + paths[idx] + " uuid:" + uuids[idx] + " idx:" + str(idx) + "\n")
+   def collectOutlinePaths(self):
+      allPaths = { } # idx:path
+      if(len(self.keys)==0):
+         raise RuntimeError("No tasks seem to have a hierarchy associated to them (e.g. X or X.Y or X.Y.Z etc.)")
+      paths = [ ] # row:path
+      for row in xrange(len(self.keys)):
+         if(self.parents[row]<0):
+            paths.append(str(self.keys[row]))
+         else:
+            paths.append(paths[self.parents[row]] + OUTLINE_SEP + str(self.keys[row]))
+         if(self.marks[row]!=None):
+            allPaths[len(allPaths)] = paths[row]
+      return allPaths
+   def collectOutlineUUIDs(self):
+      allUUIDs = { } # idx:uuid
+      for mark in self.marks:
+         if(mark!=None):
+            allUUIDs[len(allUUIDs)] = mark
+      return allUUIDs
+   def compressOutline(self):
+      self.labelIndex = None
+      # siblings are consecutive in pre-order, so just count them per parent
+      numChildren = array.array("i",[0])*(len(self.keys)+1) # parent row+1:count
+      for row in xrange(len(self.keys)):
+         parent = self.parents[row] + 1
+         numChildren[parent] = numChildren[parent] + 1
+         self.keys[row] = numChildren[parent]
+   def getSectionLabelIndex(self):
+      if(self.labelIndex==None):
+         labels = [ ]
+         uuids  = [ ]
+         rowLabels = [ ] # row:label
+         for row in xrange(len(self.keys)):
+            if(self.parents[row]<0):
+               rowLabels.append(SectionLabel((self.keys[row],)))
+            else:
+               rowLabels.append(rowLabels[self.parents[row]].child(self.keys[row]))
+            if(self.marks[row]!=None):
+               labels.append(rowLabels[row])
+               uuids.append(self.marks[row])
+         self.labelIndex = SectionLabelIndex(labels,uuids)
+      return self.labelIndex
+   # The passed function will be invoked like this:
+   #    fcn(taskUUID, taskID, taskDesc, taskStatus, userData)
+   # whenever the task should be visited.
+   def visitFromSectionToSection(self,aa,bb,fcn,userData):
+      return visitTasksFromSectionToSection(self.tasks,self.getSectionLabelIndex(),aa,bb,fcn,userData)
+
+class MatrixOutline(object):
+   """ Version of Outline for bulk work on huge outlines offering the same
+       public methods; needs NumPy. The sections are the rows of an
+       integer matrix of their labels, in outline order and padded with
+       zeros up to the deepest label (so a section sorts before its
+       subsections):
+          labels[i,:] - label of section i e.g. 1 2 3 0 0 for 1.2.3
+          uuids[i]    - uuid of the task of section i (None if unmarked)
+          marked[i]   - True if section i is marked
+       Selecting a range of sections and compressing are then a few array
+       operations over all rows instead of a walk. The structural changes
+       of a 'move' are rare and done on a temporary Outline.
+   """
+   __slots__ = ["tasks","labelIndex","labels","uuids","marked","paths"]
+   def __init__(self):
+      import numpy
+      self.tasks      = None # uuid:task dictionary
+      self.labelIndex = None # SectionLabelIndex, built when needed
+      self.labels     = numpy.zeros((0,1),numpy.int64)
+      self.uuids      = numpy.zeros(0,object)
+      self.marked     = numpy.zeros(0,bool)
+      self.paths      = None # row:path, built when needed
+   def importFromTaskWarrior(self,taskfilter,scope=(),refresh=True):
+      ol = Outline()
+      ol.importFromTaskWarrior(taskfilter,scope,refresh)
+      self.__fromOutline(ol)
+   def __fromOutline(self,ol):
+      """ Internal utility function; not meant to be invoked """
+      import numpy
+      labels,sections = ol.listSections(SectionLabel.children,SectionLabel(()))
+      depth = max([ len(label) for label in labels ] + [ 1 ])
+      padding = [ (0,)*(depth-ii) for ii in range(depth+1) ]
+      self.tasks      = ol.tasks
+      self.labelIndex = None
+      self.labels     = numpy.array([ label + padding[len(label)] for label in labels ],numpy.int64).reshape((-1,depth))
+      self.uuids      = numpy.array([ section.mark for section in sections ],object)
+      self.marked     = numpy.not_equal(self.uuids,None)
+      self.paths      = None
+   def __getRowLabels(self,rows=None):
+      """ Internal utility function; not meant to be invoked
+          Returns the SectionLabels of rows (default all rows)
+      """
+      labels = self.labels
+      if(rows is not None):
+         labels = labels[rows]
+      depths = (labels!=0).sum(axis=1).tolist()
+      return [ SectionLabel(row[0:depth]) for row,depth in itertools.izip(labels.tolist(),depths) ]
+   def toOutline(self):
+      """ Returns the equivalent Outline """
+      ol = Outline()
+      ol.tasks = self.tasks
+      for uuid,label in itertools.izip(self.uuids.tolist(),self.__getRowLabels()):
+         ol.insertStructuredLabel(uuid,label)
+      return ol
+   def isStructuredLabelInOutline(self,sl):
+      label = SectionLabel.parse(sl)
+      if(len(label)>self.labels.shape[1]):
          return False
+      return bool((self.labels[:,0:len(label)]==label).all(axis=1).any())
+   def removeOutlineForStructuredLabel(self,sl):
+      ol = self.toOutline()
+      section = ol.removeOutlineForStructuredLabel(sl)
+      self.__fromOutline(ol)
+      return section
+   def insertOutlineBeforeStructuredLabel(self,section,sl):
+      ol = self.toOutline()
+      ol.insertOutlineBeforeStructuredLabel(section,sl)
+      self.__fromOutline(ol)
+   def insertOutlineAfterStructuredLabel(self,section,sl):
+      ol = self.toOutline()
+      ol.insertOutlineAfterStructuredLabel(section,sl)
+      self.__fromOutline(ol)
+   def insertOutlineUnderStructuredLabel(self,section,sl):
+      ol = self.toOutline()
+      ol.insertOutlineUnderStructuredLabel(section,sl)
+      self.__fromOutline(ol)
+   def printOutlineAsText(self,fout=None):
+      writeLinesBuffered(itertools.imap(formatTaskAsText,self.iterateMarkedTasks()),fout)
+   def printOutlineAsLatex(self,fout=None):
+      writeLinesBuffered(itertools.imap(formatTaskAsLatex,self.iterateMarkedTasks()),fout)
+   def iterateMarkedTasks(self):
+      """ Generator yielding the tasks of the marked sections in outline order """
+      for uuid in self.uuids[self.marked].tolist():
+         if((uuid in self.tasks) == False):
+            raise RuntimeError("Implementation problem!\nuuid " + uuid + " not found in TaskWarrior")
+         yield self.tasks[uuid]
+   def printOutlineForDebugging(self):
+      sys.stdout.write("Outline:\n")
+      paths = self.collectOutlinePaths()
+      uuids = self.collectOutlineUUIDs()
+      for idx in xrange(len(paths)):
+         sys.stdout.write("   " + paths[idx] + " uuid:" + uuids[idx] + " idx:" + str(idx) + "\n")
+   def collectOutlinePaths(self):
+      if(len(self.uuids)==0):
+         raise RuntimeError("No tasks seem to have a hierarchy associated to them (e.g. X or X.Y or X.Y.Z etc.)")
+      if(self.paths is None):
+         self.paths = self.__getRowPaths()
+      return dict(enumerate(self.paths[self.marked].tolist())) # idx:path
+   def __getRowPaths(self):
+      """ Internal utility function; not meant to be invoked
+          Returns the paths of all rows, built one column at a time
+      """
+      import numpy
+      keys,positions = numpy.unique(self.labels,return_inverse=True)
+      positions = positions.reshape(self.labels.shape)
+      keys      = keys.tolist()
+      paths     = numpy.array([ str(key) for key in keys ],object)[positions[:,0]]
+      suffixes  = numpy.array([ (OUTLINE_SEP + str(key)) if key!=0 else "" for key in keys ],object)
+      for column in xrange(1,positions.shape[1]):
+         paths = paths + suffixes[positions[:,column]]
+      return paths
+   def collectOutlineUUIDs(self):
+      return dict(enumerate(self.uuids[self.marked].tolist())) # idx:uuid
+   def compressOutline(self):
+      """ Renumbers the subsections of every section 1, 2, 3... one column
+          at a time. The rows of a section are consecutive, so the new key
+          of a row is the number of distinct keys in its column from the
+          first row of its section on (a dense rank per group of rows).
+      """
+      import numpy
+      labels = self.labels
+      numRows,depth = labels.shape
+      if(numRows==0):
+         return
+      self.labelIndex = None
+      self.paths      = None
+      rows = numpy.arange(numRows)
+      compressed = numpy.zeros_like(labels)
+      firstOfSection = numpy.zeros(numRows,bool) # row starts a new section at this column
+      firstOfSection[0] = True
+      for column in xrange(depth):
+         keys = labels[:,column]
+         firstOfKey = firstOfSection.copy()
+         firstOfKey[1:] |= (keys[1:]!=keys[:-1])
+         counted = firstOfKey & (keys!=0) # rows without this column keep 0
+         rank = numpy.cumsum(counted)
+         sectionStart = numpy.maximum.accumulate(numpy.where(firstOfSection,rows,0))
+         compressed[:,column] = numpy.where(keys!=0,rank-(rank-counted)[sectionStart],0)
+         firstOfSection = firstOfKey
+      self.labels = compressed
+   def getSectionLabelIndex(self):
+      if(self.labelIndex==None):
+         self.labelIndex = SectionLabelIndex(self.__getRowLabels(self.marked),self.uuids[self.marked].tolist())
+      return self.labelIndex
+   def __compareRows(self,labels,label):
+      """ Internal utility function; not meant to be invoked
+          Returns two arrays over the rows of labels: True if the row is
+          before label in outline order, and the first column where the
+          row differs from label (the number of columns if it does not)
+      """
+      import numpy
+      padded = numpy.zeros(labels.shape[1],numpy.int64)
+      padded[0:len(label)] = label
+      different = (labels!=padded)
+      isDifferent = different.any(axis=1)
+      column   = different.argmax(axis=1)
+      isBefore = isDifferent & (labels[numpy.arange(len(labels)),column]<padded[column])
+      return (isBefore,numpy.where(isDifferent,column,labels.shape[1]))
+   # The passed function will be invoked like this:
+   #    fcn(taskUUID, taskID, taskDesc, taskStatus, userData)
+   # whenever the task should be visited.
+   def visitFromSectionToSection(self,aa,bb,fcn,userData):
+      """ Same range as SectionLabelIndex.findUUIDsFromSectionToSection(),
+          selected with masks over all rows
+      """
+      import numpy
+      aa      = SectionLabel.parse(aa)
+      afterBB = SectionLabel.parse(bb).nextSibling()
+      labels  = self.labels
+      depth   = max(len(aa),len(afterBB))
+      if(depth>labels.shape[1]):
+         labels = numpy.hstack((labels,numpy.zeros((len(labels),depth-labels.shape[1]),numpy.int64)))
+      beforeAA,firstDifferenceToAA = self.__compareRows(labels,aa)
+      beforeAfterBB = self.__compareRows(labels,afterBB)[0]
+      depths = (labels!=0).sum(axis=1)
+      # the sections containing aa differ from it right after their end
+      containsAA = (firstDifferenceToAA==depths) & (depths<len(aa))
+      selected = ((beforeAA==False) | containsAA) & beforeAfterBB & self.marked
+      return visitTasks(self.tasks,self.uuids[selected].tolist(),fcn,userData)
+
+def createOutline():
+   """ Returns an empty outline of the kind selected by OUTLINE_ENGINE """
+   if(OUTLINE_ENGINE=="compact"):
+      return CompactOutline()
+   if(OUTLINE_ENGINE=="matrix"):
+      try:
+         return MatrixOutline()
+      except ImportError:
+         return Outline() # no NumPy
+   if(OUTLINE_ENGINE!="tree"):
+      raise RuntimeError("Unknown OUTLINE_ENGINE '" + OUTLINE_ENGINE + "' (use tree, compact or matrix)")
+   return Outline()
 
 # This function will be invoked by the 'visitFromSectionToSection()' function
+# userData is expected to be a list collecting the printed lines
 def visitorPrinter(taskUUID, taskID, taskDesc, taskStatus, userData):
-   sys.stdout.write(str(taskID) + "\t" + taskStatus + "\t" + taskDesc + "\n")
+   userData.append(str(taskID) + "\t" + taskStatus + "\t" + taskDesc + "\n")
    return
 
 # This function will be invoked by the 'visitFromSectionToSection()' function
 # userData is expected to be 'CmdLineOptions'
 def visitorWaiterForAllSameWaitDate(taskUUID, taskID, taskDesc, taskStatus, userData):
-   runTaskWarriorCommand(taskUUID + " modify wait:" + userData.waitDate)
+   userData.changeSet.addWaitChange(taskUUID,userData.waitDate)
    return
 
 # This function will be invoked by the 'visitFromSectionToSection()' function
@@ -821,109 +2504,452 @@ def visitorWaiterForDistributeWaitDate(taskUUID, taskID, taskDesc, taskStatus, u
    waitDate = str(userData.waitCounter * userData.waitNumber) + userData.waitUnit
    # Debugging
    # print taskUUID + " modify wait:" + waitDate
-   runTaskWarriorCommand(taskUUID + " modify wait:" + waitDate)
+   userData.changeSet.addWaitChange(taskUUID,waitDate)
    userData.waitCounter += 1
    return
 
-def main(argv):
-   try:
-      opts = CmdLineOptions(argv)
-      if(opts.cmd=="undo"):
-         for ii in range(int(argv[opts.cmdIdx+1])):
-            runTaskWarriorCommand("undo")
-         return
-      ol = Outline()
-      ol.importFromTaskWarrior(opts.taskfilter)
+def checkMove(aa,locationCmd,bb):
+   """ Checks the move of section aa before, after or under section bb
+       as far as possible without the outline
+   """
+   if(aa==bb):
+      sys.stdout.write("Source " + aa + " and destination " + bb + " of move are the same\n")
+      sys.stdout.write("You could either:\n")
+      sys.stdout.write("   1) edit the task to modifiy the section, or\n")
+      sys.stdout.write("   2) change the move command in order to make it\n")
+      sys.stdout.write("      relative to an already existing section\n")
+      raise RuntimeError("Can't move " + aa + " " + locationCmd + " " + bb)
+   if(SectionLabel.parse(aa).isPrefixOf(SectionLabel.parse(bb))):
+      sys.stdout.write("Section " + aa + " is a super section of " + bb + "\n")
+      sys.stdout.write("You could either:\n")
+      sys.stdout.write("   1) manually edit the outline or\n")
+      sys.stdout.write("   2) move " + bb + " to another location and try again\n")
+      raise RuntimeError("Cannot move '" + aa + "' under '" + bb + "'")
+
+def moveSectionInOutline(ol,aa,locationCmd,bb):
+   """ Moves section aa before, after or under section bb of ol """
+   checkMove(aa,locationCmd,bb)
+   if(ol.isStructuredLabelInOutline(aa)==False):
+      raise RuntimeError("Section '" + aa + "' is not in the outline (typo?)")
+   if(ol.isStructuredLabelInOutline(bb)==False):
+      raise RuntimeError("Section '" + bb + "' is not in the outline (typo?)")
+   A = ol.removeOutlineForStructuredLabel(aa)
+   if(locationCmd=="before"):
+      ol.insertOutlineBeforeStructuredLabel(A,bb)
+   if(locationCmd=="after"):
+      ol.insertOutlineAfterStructuredLabel(A,bb)
+   if(locationCmd=="under"):
+      ol.insertOutlineUnderStructuredLabel(A,bb)
+
+def getCommonSection(labels):
+   """ The deepest section containing all of labels (SectionLabels); the
+       empty label stands for the whole outline
+   """
+   common = labels[0]
+   for label in labels[1:]:
+      depth = 0
+      while((depth<len(common)) and (depth<len(label)) and (common[depth]==label[depth])):
+         depth = depth + 1
+      common = SectionLabel(common[0:depth])
+   return common
+
+def getMoves(opts,argv):
+   """ The (sectionA, before|after|under, sectionB) of 'move' or 'moves' """
+   if(opts.cmd=="move"):
+      return [ (opts.getSectionLabelForSectionA(argv),opts.getLocationCommand(argv),opts.getSectionLabelForSectionB(argv)) ]
+   return opts.moves
+
+def getOperationScope(opts,argv):
+   """ The section the command works in, so that only it has to be
+       imported (see OUTLINE_SCOPE); the empty label means the whole
+       outline. Inserting before or after a section may renumber its
+       siblings, so a move also needs the section containing them.
+   """
+   if(OUTLINE_SCOPE==False):
+      return SectionLabel(())
+   labels = [ ]
+   if(((opts.cmd=="tableofcontents") and (opts.tocSel=="from")) or (opts.cmd=="modify")):
+      labels.append(SectionLabel.parse(opts.getSectionLabelForSectionA(argv)))
+      labels.append(SectionLabel.parse(opts.getSectionLabelForSectionB(argv)))
+   if(opts.cmd in [ "move", "moves" ]):
+      for aa,locationCmd,bb in getMoves(opts,argv):
+         labels.append(SectionLabel.parse(aa))
+         if(locationCmd=="under"):
+            labels.append(SectionLabel.parse(bb))
+         else:
+            labels.append(SectionLabel(SectionLabel.parse(bb)[0:-1]))
+   if(len(labels)==0):
+      return SectionLabel(())
+   return getCommonSection(labels)
+
+def importOutline(taskfilter,scope,forChanges):
+   """ The outline of taskfilter, only for section scope if it has any
+       task there; forChanges gives an outline that the caller may change
+   """
+   with theStatistics.span("import outline"):
+      if(theOutlineMemory!=None):
+         ol = theOutlineMemory.getOutline(taskfilter,scope,forChanges)
+      else:
+         ol = createOutline()
+         # a renumbering based on an outline that misses synchronized
+         # tasks could give two tasks the same label
+         ol.importFromTaskWarrior(taskfilter,scope,forChanges==False)
+   if((len(scope)>0) and (len(ol.tasks)==0)):
+      # let the whole outline tell what is wrong with the command
+      return importOutline(taskfilter,SectionLabel(()),forChanges)
+   return ol
+
+def moveSectionsInScope(opts,moves,scope):
+   """ Makes the moves in the outline of opts.taskfilter imported for
+       section scope and returns their change set. Should a move need a
+       section that was not imported, or renumber one outside scope, the
+       import is widened to the section containing scope and the moves
+       are made again, up to the whole outline.
+   """
+   for aa,locationCmd,bb in moves:
+      checkMove(aa,locationCmd,bb)
+   while True:
+      ol = importOutline(opts.taskfilter,scope,True)
+      with theStatistics.span("collect outline"):
+         initialPaths = ol.collectOutlinePaths()
+         initialUUIDs = ol.collectOutlineUUIDs()
+      try:
+         # every move works on the outline left by the previous ones and
+         # only the net changes are written
+         with theStatistics.span("move outline"):
+            for aa,locationCmd,bb in moves:
+               moveSectionInOutline(ol,aa,locationCmd,bb)
+      except RuntimeError:
+         if(len(scope)==0):
+            raise
+         ol = None
+      if(ol!=None):
+         with theStatistics.span("collect outline"):
+            movedPaths = ol.collectOutlinePaths()
+            movedUUIDs = ol.collectOutlineUUIDs()
+         changeSet = collectChangesForMovedPaths(
+            initialPaths, initialUUIDs, movedPaths, movedUUIDs)
+         if(changeSet.isInsideSection(scope)):
+            return changeSet
+      theStatistics.count("imports widened")
+      scope = SectionLabel(scope[0:-1])
+
+def runCommand(opts,argv,fout):
+   """ Runs the command parsed into opts; the table of contents is
+       written to fout
+   """
+   if(opts.cmd=="undo"):
+      if(theOutlineMemory!=None):
+         raise RuntimeError("'task undo' asks for a confirmation, run undo without --server")
+      for ii in range(int(argv[opts.cmdIdx+1])):
+         runTaskWarriorCommand("undo")
+      return
+   if(opts.cmd=="undo-last"):
+      with theStatistics.span("apply changes"):
+         undoLastOperation()
+      return
+   if(opts.cmd=="apply"):
+      changeSet = TaskWarriorChangeSet.readPlan(argv[opts.cmdIdx+1])
+      with theStatistics.span("apply changes"):
+         numCmds = changeSet.apply(string.join(argv))
+      writeUndoMessage(numCmds)
+      return
+   if(opts.cmd=="serve"):
+      if(theOutlineMemory!=None):
+         raise RuntimeError("Already serving")
+      serveOutlines(getServerSocketPath())
+      return
+   scope = getOperationScope(opts,argv)
+   if(opts.cmd in [ "move", "moves" ]):
+      changeSet = moveSectionsInScope(opts,getMoves(opts,argv),scope)
+      numCmds = applyOrPlanChangeSet(changeSet,opts,argv)
+      if(numCmds!=None):
+         writeUndoMessage(numCmds)
+      return
+   ol = importOutline(opts.taskfilter,scope,opts.cmd=="compress")
+   with theStatistics.span("collect outline"):
       initialPaths = ol.collectOutlinePaths()
       initialUUIDs = ol.collectOutlineUUIDs()
-      if(opts.cmd=="tableofcontents"):
-         # twOutline <filter> tableofcontents all text|latex
-         if(opts.tocSel=="all"):
+   if(opts.cmd=="tableofcontents"):
+      # twOutline <filter> tableofcontents all text|latex
+      if(opts.tocSel=="all"):
+         with theStatistics.span("render outline"):
             if(opts.tocType=="text"):
-               ol.printOutlineAsText()
+               ol.printOutlineAsText(fout)
             if(opts.tocType=="latex"):
-               ol.printOutlineAsLatex()
-         # twOutline <filter> tableofcontents from <sectionA> to <sectionB> text
-         if(opts.tocSel=="from"):
-            aa = opts.getSectionLabelForSectionA(argv)
-            bb = opts.getSectionLabelForSectionB(argv)
-            numberOfVisits = ol.visitFromSectionToSection(aa,bb,visitorPrinter,None)
-            sys.stdout.write("\n" + str(numberOfVisits) + " tasks\n")
+               ol.printOutlineAsLatex(fout)
+      # twOutline <filter> tableofcontents from <sectionA> to <sectionB> text
+      if(opts.tocSel=="from"):
+         aa = opts.getSectionLabelForSectionA(argv)
+         bb = opts.getSectionLabelForSectionB(argv)
+         lines = [ ]
+         with theStatistics.span("render outline"):
+            numberOfVisits = ol.visitFromSectionToSection(aa,bb,visitorPrinter,lines)
+            writeLinesBuffered(lines,fout)
+         sys.stdout.write("\n" + str(numberOfVisits) + " tasks\n")
 
-      if(opts.cmd=="compress"):
+   if(opts.cmd=="compress"):
+      with theStatistics.span("compress outline"):
          ol.compressOutline()
+      with theStatistics.span("collect outline"):
          compressedPaths = ol.collectOutlinePaths()
          compressedUUIDs = ol.collectOutlineUUIDs()
-         issueTaskWarriorModifyCommandsForCompressedPaths(
-            initialPaths, initialUUIDs, compressedPaths, compressedUUIDs)
-      if(opts.cmd=="move"):
-         locationCmd = opts.getLocationCommand(argv)
-         aa = opts.getSectionLabelForSectionA(argv)
-         bb = opts.getSectionLabelForSectionB(argv)
-         if(aa==bb):
-            sys.stdout.write("Source " + aa + " and destination " + bb + " of move are the same\n")
-            sys.stdout.write("You could either:\n")
-            sys.stdout.write("   1) edit the task to modifiy the section, or\n")
-            sys.stdout.write("   2) change the move command in order to make it\n")
-            sys.stdout.write("      relative to an already existing section\n")
-            raise RuntimeError("Can't move " + aa + " " + locationCmd + " " + bb)
-         if(bb.startswith(aa)):
-            sys.stdout.write("Section " + aa + " is a super section of " + bb + "\n")
-            sys.stdout.write("You could either:\n")
-            sys.stdout.write("   1) manually edit the outline or\n")
-            sys.stdout.write("   2) move " + bb + " to another location and try again\n")
-            raise RuntimeError("Cannot move '" + aa + "' under '" + bb + "'")
-         if(ol.isStructuredLabelInOutline(aa)==False):
-            raise RuntimeError("Section '" + aa + "' is not in the outline (typo?)")
-         if(ol.isStructuredLabelInOutline(bb)==False):
-            raise RuntimeError("Section '" + bb + "' is not in the outline (typo?)")
-         A = ol.removeOutlineForStructuredLabel(aa)
-         if(locationCmd=="before"):
-            ol.insertOutlineBeforeStructuredLabel(A,bb)
-         if(locationCmd=="after"):
-            ol.insertOutlineAfterStructuredLabel(A,bb)
-         if(locationCmd=="under"):
-            ol.insertOutlineUnderStructuredLabel(A,bb)
-         movedPaths = ol.collectOutlinePaths()
-         movedUUIDs = ol.collectOutlineUUIDs()
-         issueTaskWarriorModifyCommandsForMovedPaths(
-            initialPaths, initialUUIDs, movedPaths, movedUUIDs)
-      if(opts.cmd=="modify"):
-         #print "cmdIdx      = " + str(opts.cmdIdx)
-         #print "sectionAIdx = " + str(opts.sectionAIdx)
-         #print "sectionBIdx = " + str(opts.sectionBIdx)
-         #if(opts.modifyCmd=="wait"):
-         #   print "waitType    = " + opts.waitType
-         #   if(opts.waitType=="all"):
-         #      print "waitDate    = " + opts.waitDate
-         #   if(opts.waitType=="distribute"):
-         #      print "waitNumber  = " + str(opts.waitNumber) # a positive number
-         #      print "waitUnit    = " + opts.waitUnit        # a valid unit e.g. hours, days, weeks, etc.
+      changeSet = collectChangesForCompressedPaths(
+         initialPaths, initialUUIDs, compressedPaths, compressedUUIDs)
+      numCmds = applyOrPlanChangeSet(changeSet,opts,argv)
+      if(numCmds!=None):
+         writeUndoMessage(numCmds)
+   if(opts.cmd=="modify"):
+      #print "cmdIdx      = " + str(opts.cmdIdx)
+      #print "sectionAIdx = " + str(opts.sectionAIdx)
+      #print "sectionBIdx = " + str(opts.sectionBIdx)
+      #if(opts.modifyCmd=="wait"):
+      #   print "waitType    = " + opts.waitType
+      #   if(opts.waitType=="all"):
+      #      print "waitDate    = " + opts.waitDate
+      #   if(opts.waitType=="distribute"):
+      #      print "waitNumber  = " + str(opts.waitNumber) # a positive number
+      #      print "waitUnit    = " + opts.waitUnit        # a valid unit e.g. hours, days, weeks, etc.
 
-         aa = opts.getSectionLabelForSectionA(argv)
-         bb = opts.getSectionLabelForSectionB(argv)
-         if(ol.isStructuredLabelInOutline(aa)==False):
-            raise RuntimeError("Section '" + aa + "' is not in the outline (typo?)")
-         if(ol.isStructuredLabelInOutline(bb)==False):
-            raise RuntimeError("Section '" + bb + "' is not in the outline (typo?)")
-
-         if(opts.modifyCmd=="wait"):
-            if(opts.waitType=="all"):
-               #print "modify " + argv[opts.sectionAIdx] + " to " + argv[opts.sectionBIdx] + " wait all " + opts.waitDate
-               #ol.printOutlineForDebugging()
-               #ol.visitFromSectionToSection(aa,bb,visitorPrinter,None)
-               numberOfVisits = ol.visitFromSectionToSection(aa,bb,visitorWaiterForAllSameWaitDate,opts)
-               sys.stdout.write("\n" + str(numberOfVisits) + " tasks modified\n")
-            if(opts.waitType=="distribute"):
-               # wait distribute <number> <unit>
-               # print "modify " + argv[opts.sectionAIdx] + " to " + argv[opts.sectionBIdx] + " wait distribute " + str(opts.waitNumber) + " " + opts.waitUnit
-               numberOfVisits = ol.visitFromSectionToSection(aa,bb,visitorWaiterForDistributeWaitDate,opts)
-               sys.stdout.write("\n" + str(numberOfVisits) + " tasks modified\n")
+      aa = opts.getSectionLabelForSectionA(argv)
+      bb = opts.getSectionLabelForSectionB(argv)
+      if(ol.isStructuredLabelInOutline(aa)==False):
+         raise RuntimeError("Section '" + aa + "' is not in the outline (typo?)")
+      if(ol.isStructuredLabelInOutline(bb)==False):
+         raise RuntimeError("Section '" + bb + "' is not in the outline (typo?)")
+
+      if(opts.modifyCmd=="wait"):
+         opts.changeSet = TaskWarriorChangeSet()
+         if(opts.waitType=="all"):
+            #print "modify " + argv[opts.sectionAIdx] + " to " + argv[opts.sectionBIdx] + " wait all " + opts.waitDate
+            #ol.printOutlineForDebugging()
+            #ol.visitFromSectionToSection(aa,bb,visitorPrinter,None)
+            with theStatistics.span("visit outline"):
+               ol.visitFromSectionToSection(aa,bb,visitorWaiterForAllSameWaitDate,opts)
+         if(opts.waitType=="distribute"):
+            # wait distribute <number> <unit>
+            # print "modify " + argv[opts.sectionAIdx] + " to " + argv[opts.sectionBIdx] + " wait distribute " + str(opts.waitNumber) + " " + opts.waitUnit
+            with theStatistics.span("visit outline"):
+               ol.visitFromSectionToSection(aa,bb,visitorWaiterForDistributeWaitDate,opts)
+         numModified = applyOrPlanChangeSet(opts.changeSet,opts,argv)
+         if(numModified!=None):
+            sys.stdout.write("\n" + str(numModified) + " tasks modified\n")
 
+def runCommandWithProfiler(opts,argv,fout,path):
+   """ Runs the command under cProfile; path '-' prints the functions with
+       the most cumulative time, any other path gets the raw profile data
+       (see the pstats module)
+   """
+   import cProfile
+   import pstats
+   profiler = cProfile.Profile()
+   try:
+      profiler.runcall(runCommand,opts,argv,fout)
+   finally:
+      if(path=="-"):
+         pstats.Stats(profiler,stream=sys.stderr).sort_stats("cumulative").print_stats(PROFILE_TOP_FUNCTIONS)
+      else:
+         profiler.dump_stats(path)
+
+class OutlineMemory(object):
+   """ The outlines imported by 'serve', kept between requests for as
+       long as the TaskWarrior data files do not change
+   """
+   def __init__(self):
+      self.entries = { } # (filter, scope):(data file stamps, outline, may be refreshed)
+   def getOutline(self,taskfilter,scope,forChanges):
+      """ The outline for taskfilter and section scope; forChanges gives a
+          copy that the caller may change
+      """
+      # take the stamps before importing so that changes made while we
+      # read are picked up by the next request
+      files = getTaskWarriorDataFileStamps()
+      key   = (taskfilter,SectionLabel(()))
+      entry = self.entries.get(key)
+      if((len(scope)>0) and (self.__isUpToDate(entry,files,forChanges)==False)):
+         # an up to date whole outline serves any scope
+         key   = (taskfilter,scope)
+         entry = self.entries.get(key)
+      if(self.__isUpToDate(entry,files,forChanges)==False):
+         ol = createOutline()
+         # see importOutline(): no refresh for an outline that gets renumbered
+         ol.importFromTaskWarrior(taskfilter,scope,forChanges==False)
+         entry = (files,ol,forChanges==False)
+         self.entries[key] = entry
+         while(len(self.entries)>OUTLINE_CACHE_ENTRIES):
+            del self.entries[self.entries.keys()[0]]
+      else:
+         theStatistics.count("outlines kept in memory")
+      if(forChanges==True):
+         return cPickle.loads(cPickle.dumps(entry[1],cPickle.HIGHEST_PROTOCOL))
+      return entry[1]
+   def __isUpToDate(self,entry,files,forChanges):
+      """ Internal utility function; not meant to be invoked
+          An outline that may come from a refreshed cache entry is not
+          used for changes
+      """
+      return ((entry!=None) and (entry[0]==files) and ((forChanges==False) or (entry[2]==False)) and
+              (hasExpiredWaitDate(entry[1].tasks)==False))
+
+theOutlineMemory = None # OutlineMemory while 'serve' runs
+
+class ServerOutput(object):
+   """ Collects what a request writes to sys.stdout or sys.stderr """
+   def __init__(self):
+      self.parts = [ ]
+   def write(self,text):
+      if(isinstance(text,unicode)):
+         text = text.encode("utf-8")
+      self.parts.append(text)
+   def flush(self):
+      pass
+   def getvalue(self):
+      return "".join(self.parts)
+
+def getServerSocketPath():
+   if(SERVE_SOCKET!=""):
+      return os.path.expanduser(SERVE_SOCKET)
+   return os.path.join(getTaskWarriorDataLocation(),"twoutline.sock")
+
+def runServerRequest(argv,cwd):
+   """ Runs one command line for a client and returns its output """
+   global theStatistics
+   savedStreams = (sys.stdout,sys.stderr)
+   savedCwd = os.getcwd()
+   sys.stdout = ServerOutput()
+   sys.stderr = ServerOutput()
+   theStatistics = RunStatistics()
+   setTaskWarriorExecutor(None) # main() closes the executor of each request
+   SectionLabel.clearInterned()
+   try:
+      if(cwd!=None):
+         os.chdir(cwd)
+      try:
+         main(argv)
+      except Exception:
+         # report the bug to the client instead of stopping the server
+         import traceback
+         traceback.print_exc()
+      return { "output":sys.stdout.getvalue(), "errors":sys.stderr.getvalue() }
+   finally:
+      sys.stdout,sys.stderr = savedStreams
+      os.chdir(savedCwd)
+
+def serveOutlines(path):
+   """ Answers the command lines sent by 'twOutline --server' on the Unix
+       socket at path, one JSON object per line each way:
+          request  {"argv": [...], "cwd": "..."}
+          response {"output": "...", "errors": "..."}
+       Imported outlines stay in memory until the data files change.
+   """
+   import signal
+   import socket
+   global theOutlineMemory
+   if(os.path.exists(path)):
+      probe = socket.socket(socket.AF_UNIX,socket.SOCK_STREAM)
+      try:
+         probe.connect(path)
+         probe.close()
+         raise RuntimeError("A twOutline server is already running on '" + path + "'")
+      except socket.error:
+         os.remove(path) # left behind by a server that did not stop cleanly
+   server = socket.socket(socket.AF_UNIX,socket.SOCK_STREAM)
+   server.bind(path)
+   server.listen(5)
+   theOutlineMemory = OutlineMemory()
+   signal.signal(signal.SIGTERM,lambda signum,frame: sys.exit(0))
+   sys.stdout.write("twOutline serving on " + path + " (Ctrl-C to stop)\n")
+   sys.stdout.flush()
+   try:
+      while True:
+         conn,address = server.accept()
+         try:
+            fin = conn.makefile("rb")
+            request = json.loads(fin.readline())
+            fin.close()
+            response = runServerRequest(request["argv"],request.get("cwd"))
+            conn.sendall(json.dumps(response) + "\n")
+         except (socket.error,ValueError,KeyError) as e:
+            sys.stderr.write("twOutline could not answer a request: " + str(e) + "\n")
+         finally:
+            conn.close()
+   except KeyboardInterrupt:
+      pass
+   finally:
+      theOutlineMemory = None
+      server.close()
+      os.remove(path)
+
+def runClient(argv,path):
+   """ Has the server on path run the command line and prints its answer """
+   import socket
+   client = socket.socket(socket.AF_UNIX,socket.SOCK_STREAM)
+   try:
+      try:
+         client.connect(path)
+      except socket.error as e:
+         raise RuntimeError("No twOutline server on '" + path + "' (" + str(e) + "), start one with 'twOutline serve'")
+      client.sendall(json.dumps({ "argv":argv, "cwd":os.getcwd() }) + "\n")
+      fin = client.makefile("rb")
+      line = fin.readline()
+      fin.close()
+   finally:
+      client.close()
+   if(line==""):
+      raise RuntimeError("The twOutline server on '" + path + "' did not answer")
+   response = json.loads(line)
+   sys.stdout.write(response["output"].encode("utf-8"))
+   sys.stderr.write(response["errors"].encode("utf-8"))
+
+def main(argv):
+   options = { }
+   try:
+      clientOptions,argv = extractLongOptions(argv,{ "--server":False })
+      # undo runs here since 'task undo' asks for a confirmation on the
+      # terminal, which the server does not have
+      if(("--server" in clientOptions) and (("undo" in argv) == False)):
+         runClient(argv,getServerSocketPath())
+         return
+      options,argv = extractLongOptions(argv,{ "--jobs":True, "--output":True, "--pending":False, "--plan":True, "--profile":True, "--stats":True })
+      if("--jobs" in options):
+         if(options["--jobs"].isdigit()==False):
+            raise RuntimeError("--jobs should be a positive number but it was '" + options["--jobs"] + "'")
+         setTaskWarriorExecutor(createTaskWarriorExecutor(max(1,int(options["--jobs"]))))
+      if(options.get("--stats","text") not in [ "text", "json" ]):
+         raise RuntimeError("--stats should be text or json but it was '" + options["--stats"] + "'")
+      if(("--stats" in options) or ("--profile" in options)):
+         theStatistics.enabled = True
+      opts = CmdLineOptions(argv)
+      if("--pending" in options):
+         opts.taskfilter = combineTaskWarriorFilters(opts.taskfilter,PENDING_FILTER)
+      if("--plan" in options):
+         if(opts.cmd not in [ "compress", "move", "moves", "modify" ]):
+            raise RuntimeError("--plan only works with compress, move, moves and modify")
+         opts.planPath = options["--plan"]
+      fout = sys.stdout
+      if("--output" in options):
+         fout = openOutputFile(options["--output"])
+      try:
+         if("--profile" in options):
+            runCommandWithProfiler(opts,argv,fout,options["--profile"])
+         else:
+            runCommand(opts,argv,fout)
+      finally:
+         if(fout!=sys.stdout):
+            fout.close()
       sys.stdout.flush()
    except RuntimeError as e:
       print e
       sys.stdout.flush()
+   finally:
+      if(theTaskWarriorExecutor!=None):
+         theTaskWarriorExecutor.close()
+      if(theStatistics.enabled==True):
+         if(options.get("--stats")=="json"):
+            theStatistics.writeAsJSON(sys.stderr)
+         else:
+            theStatistics.writeAsText(sys.stderr)
 
-main(sys.argv[1:])
+if __name__ == "__main__":
+   main(sys.argv[1:])
  